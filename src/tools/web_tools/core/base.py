@@ -3,11 +3,12 @@
 """
 
 import os
+import copy
+import time
+import json
 import hashlib
 import asyncio
 import random
-import pickle
-import time
 from urllib.parse import urljoin, parse_qs, unquote
 from abc import ABCMeta, abstractmethod
 from contextlib import suppress
@@ -18,6 +19,10 @@ import aiohttp
 from bs4 import BeautifulSoup
 
 from src.tools.web_tools.core import utils
+from src.tools.web_tools.core import domains
+from src.tools.web_tools.core import ratelimit
+from src.tools.web_tools.core import executor
+from src.tools.web_tools.core import metrics
 from src.tools.web_tools.core.exceptions import NoResultsOrTrafficError
 
 
@@ -35,6 +40,60 @@ def get_data(file_path):
                 text_list.append(line)
     return text_list
 
+
+DOMAIN_PATH = os.path.join(utils.FILEPATH, "data/all_domain.txt")
+USER_AGENT_PATH = os.path.join(utils.FILEPATH, "data/user_agents.txt")
+
+# shared by every engine, loaded on first use (see `get_domains`)
+_domains = None
+_user_agents = None
+
+
+def get_domains():
+    """
+    Returns the search domains, without the blocked ones. Read once and
+    shared by every engine.
+
+    :rtype: tuple[str]
+    """
+    global _domains
+    if _domains is None:
+        blocked = set(utils.blocked_domains)
+        _domains = tuple(dict.fromkeys(d for d in get_data(DOMAIN_PATH) if d not in blocked))
+        print("Number of domains: {}".format(len(_domains)))
+    return _domains
+
+
+def get_user_agents():
+    """
+    Returns the user agents requests are made with. Read once and shared by
+    every engine.
+
+    :rtype: tuple[str]
+    """
+    global _user_agents
+    if _user_agents is None:
+        _user_agents = tuple(get_data(USER_AGENT_PATH))
+    return _user_agents
+
+
+def reload_data():
+    """
+    Reads the domain and user agent lists again, e.g after editing the data
+    files. Engines created before keep the lists they were created with.
+    """
+    global _domains, _user_agents
+    _domains = _user_agents = None
+    get_domains()
+    get_user_agents()
+
+
+# search arguments that do not change search results
+PAGE_CACHE_IGNORED_PARAMS = ("proxy", "proxy_auth")
+# result of `BaseSearch.asearch` when the SERP has fewer results than `topk`
+NO_EVIDENCE = {"page": "No evidence found, please change query."}
+
+
 @unique
 class ReturnType(Enum):
     FULL = "full"
@@ -42,6 +101,15 @@ class ReturnType(Enum):
     DESCRIPTION = "description"
     LINK = "link"
 
+
+async def _close_on_shutdown(session):
+    """ Async generator closing `session` when it is closed, see `BaseSearch.get_session` """
+    try:
+        yield
+    finally:
+        await session.close()
+
+
 class BaseSearch:
 
     __metaclass__ = ABCMeta
@@ -60,18 +128,68 @@ class BaseSearch:
     _parsed_url = None
     # boolean that indicates cache hit or miss
     _cache_hit = False
-    
-    def __init__(self, proxy=None):
+    # connection pool of the engine: total / per-host connection limits,
+    # seconds to keep idle connections alive and seconds to cache DNS lookups
+    connection_limit = 100
+    connection_limit_per_host = 10
+    keepalive_timeout = 30
+    dns_cache_ttl = 300
+    # fetch the result pages of a SERP concurrently (see `acomplete_entries`):
+    # only as many as could still be needed, at most `page_concurrency`
+    concurrent_pages = False
+    page_concurrency = 5
+    # results carry the text of their page as `page` (see `acomplete_entry`),
+    # otherwise they only have the title, link and description of the SERP
+    fetches_pages = False
+    # how `get_source` retries failed requests
+    retry_policy = utils.RetryPolicy()
+    # version of the result parsing, bumped when it changes so that results
+    # cached by an older parser are not served
+    parser_version = 1
+    # also serve results cached under the bare query, the key used before
+    # engine, end year and parameters were part of it (they are copied to
+    # the current key when served)
+    legacy_page_cache = False
+    # cache the parse of source codes (see `aparse_entries`)
+    parse_cache = True
+    # `bs4.SoupStrainer` of the elements `parse_soup` looks for (see
+    # `utils.class_strainer`): the rest of a SERP is not parsed. None parses it all
+    result_strainer = None
+    # choose the search domain of engines without a `search_url` by health
+    # (see `domains.DomainScheduler`) instead of uniformly at random
+    domain_scheduling = True
+    # throttling shared by every engine of the process (see `ratelimit`):
+    # requests per second (with bursts) and concurrent requests to the search
+    # domains of the engine, and to any single host. None is unlimited
+    rate_limit = None
+    rate_burst = 1
+    max_concurrency = None
+    host_rate_limit = None
+    host_rate_burst = 1
+    host_max_concurrency = None
+    # send a duplicate of a slow search to another domain and use the first
+    # answer (see `domains.HedgePolicy`): after the `hedge_quantile` of the
+    # latencies of the engine, at most `hedge_budget` extra searches per search
+    hedging = False
+    hedge_quantile = 0.9
+    hedge_budget = 0.1
+    # add the timings and counters of the search (see `metrics`) to its
+    # result as `metrics`
+    attach_metrics = True
+
+    def __init__(self, proxy=None, cache_handler=None):
+        """
+        :param proxy: proxy address to make use off
+        :type proxy: str
+        :param cache_handler: cache of the engine, defaults to the one shared by all engines
+        :type cache_handler: `utils.CacheHandler`
+        """
         self.proxy = proxy
-        self.page_cache_path = os.path.join(utils.FILEPATH, "cache/pages")
-        self.domain_list = get_data(file_path=os.path.join(utils.FILEPATH, "data/all_domain.txt"))
-        # remove blocked domains
-        self.domain_list = list(set(self.domain_list) - set(utils.blocked_domains))
-        self.agent_list = get_data(file_path=os.path.join(utils.FILEPATH, "data/user_agents.txt"))
-        print("Number of domains: {}".format(len(self.domain_list)))
-
-        if not os.path.exists(self.page_cache_path):
-            os.makedirs(self.page_cache_path)
+        # pooled client session of each event loop (see `get_session`)
+        self._sessions = {}
+        self._cache_handler = cache_handler
+        self.domain_list = get_domains()
+        self.agent_list = get_user_agents()
 
     @abstractmethod
     def parse_soup(self, soup):
@@ -89,15 +207,65 @@ class BaseSearch:
         raise NotImplementedError(
             "subclasses must define method <parse_results>")
 
+    def parse_entry(self, single_result, **kwargs):
+        """
+        Extracts an entry from a single result without fetching anything over the
+        network. Engines that download result pages split `parse_single_result`
+        into `parse_entry` and `acomplete_entry`, by default the entry is the
+        fully parsed result.
+        """
+        return self.parse_single_result(single_result, **kwargs)
+
+    async def acomplete_entry(self, entry):
+        """
+        Turns an entry of `parse_entry` into a result, e.g by fetching its page.
+        Returns None when the entry should be skipped.
+        """
+        return entry
+
     def get_cache_handler(self):
         """ Return Cache Handler to use"""
-
-        return utils.CacheHandler()
+        if self._cache_handler is not None:
+            return self._cache_handler
+        return utils.get_cache_handler()
 
     @property
     def cache_handler(self):
         return self.get_cache_handler()
 
+    def get_limits(self, url, serp=False):
+        """
+        Throttling of a request to `url`: the limit of the engine for its
+        searches, and the limit of the host
+
+        :param serp: whether the request is a search, e.g not the page of a result
+        :type serp: bool
+        :rtype: list[`ratelimit.Limit`]
+        """
+        host = urlparse(url).netloc
+        limits = []
+        if (self.rate_limit or self.max_concurrency) and serp:
+            limits.append(ratelimit.get_limit(
+                ("engine", self.name), self.rate_limit, self.rate_burst, self.max_concurrency))
+        if self.host_rate_limit or self.host_max_concurrency:
+            limits.append(ratelimit.get_limit(
+                ("host", host), self.host_rate_limit, self.host_rate_burst, self.host_max_concurrency))
+        return limits
+
+    @property
+    def domain_scheduler(self):
+        """ Scheduler of the search domains, shared by the engines of the same name """
+        return domains.get_scheduler(self.name, self.domain_list)
+
+    @property
+    def hedge_policy(self):
+        """ Hedging policy of the searches, shared by the engines of the same name """
+        return domains.get_hedge_policy(self.name, quantile=self.hedge_quantile, budget=self.hedge_budget)
+
+    @property
+    def page_cache_path(self):
+        return self.cache_handler.page_cache
+
     def parse_result(self, results, num_pages, **kwargs):
         """
         Runs every entry on the page through parse_single_result
@@ -108,6 +276,11 @@ class BaseSearch:
             returns.
         :rtype: dict
         """
+        if self.concurrent_pages:
+            loop = utils.get_event_loop()
+            return loop.run_until_complete(
+                self.aparse_result(results, num_pages, **kwargs))
+
         search_results = []
         for each in results:
             # get at leat num_pages results
@@ -118,6 +291,92 @@ class BaseSearch:
                 search_results.append(rdict)
         return search_results
 
+    async def aparse_result(self, results, num_pages, **kwargs):
+        """
+        Same as `parse_result`, but extracts every entry of the page first and then
+        completes them, concurrently with `concurrent_pages` (see
+        `acomplete_entries`).
+
+        :param results: Result of main search to extract individual results
+        :type results: list[`bs4.element.ResultSet`]
+        :rtype: list
+        """
+        # extract entries before awaiting anything, parsing may rely on engine
+        # state set by `parse_soup` that another search could change meanwhile
+        entries = []
+        for each in results:
+            entry = self.parse_entry(each, **kwargs)
+            if entry is not None:
+                entries.append(entry)
+        return await self.acomplete_entries(entries, num_pages)
+
+    async def acomplete_entries(self, entries, num_pages):
+        """
+        Completes the entries of a page into at most `num_pages` results, in
+        the order of the page. With `concurrent_pages` entries are completed
+        concurrently, but no more than could still become results: an entry
+        is only started when an earlier one turned out to be skipped, so the
+        same pages are fetched as one after the other. At most
+        `page_concurrency` are completed at once.
+
+        :param entries: entries of `parse_entry`
+        :type entries: list
+        :rtype: list
+        """
+        if not self.concurrent_pages:
+            search_results = []
+            for entry in entries:
+                if len(search_results) >= num_pages:
+                    break
+                rdict = await self.acomplete_entry(entry)
+                if rdict is not None:
+                    search_results.append(rdict)
+            return search_results
+
+        tasks = []
+        running = set()
+        completed = {}
+        found = 0
+        try:
+            while True:
+                # results found and results still possible never exceed num_pages,
+                # so the results are the first ones of the page once all are done
+                while len(tasks) < len(entries) and len(running) < self.page_concurrency \
+                        and found + len(running) < num_pages:
+                    task = asyncio.ensure_future(self.acomplete_entry(entries[len(tasks)]))
+                    tasks.append(task)
+                    running.add(task)
+                if not running:
+                    break
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    rdict = task.result()
+                    completed[tasks.index(task)] = rdict
+                    if rdict is not None:
+                        found += 1
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # also marks the errors of the other tasks as retrieved
+                    task.exception()
+        return [completed[i] for i in sorted(completed) if completed[i] is not None]
+
+    def is_found(self, result):
+        """
+        Whether a result was found, and can be cached: with `fetches_pages` it
+        has the text of its page, otherwise a title
+
+        :rtype: bool
+        """
+        if not isinstance(result, dict):
+            return False
+        if self.fetches_pages:
+            return isinstance(result.get("page"), str) and bool(result["page"].strip()) \
+                and result["page"] != NO_EVIDENCE["page"]
+        return result.get("title") is not None
+
     def get_params(self, query=None, page=None, offset=None, **kwargs):
         """ This  function should be overwritten to return a dictionary of query params"""
         return {'q': query, 'page': page}
@@ -141,42 +400,210 @@ class BaseSearch:
             return self.cache_handler.clear()
         return self.cache_handler.clear(self.name)
 
-    async def get_source(self, url, cache=True):
+    async def get_session(self):
+        """
+        Returns the pooled client session of the engine for the running event
+        loop. The session is created lazily and recreated when it was closed,
+        so connections (and resolved hosts) are reused across requests. It is
+        closed when the loop shuts down, e.g at the end of `asyncio.run`.
+
+        :rtype: `aiohttp.ClientSession`
+        """
+        loop = asyncio.get_running_loop()
+        session, _ = self._sessions.get(loop, (None, None))
+        if session is None or session.closed:
+            # forget the sessions of the loops that are gone
+            for other in [other for other in self._sessions if other.is_closed()]:
+                self._sessions.pop(other, None)
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl)
+            session = aiohttp.ClientSession(connector=connector)
+            # the loop closes its pending async generators before closing
+            # (`loop.shutdown_asyncgens`), the guard then closes the session
+            guard = _close_on_shutdown(session)
+            await guard.__anext__()
+            self._sessions[loop] = (session, guard)
+        return session
+
+    async def aclose(self):
+        """
+        Closes the pooled client session of the engine for the running event loop
+        """
+        session, guard = self._sessions.pop(asyncio.get_running_loop(), (None, None))
+        if session is not None:
+            await guard.aclose()
+
+    def close(self):
+        """
+        Closes the pooled client sessions from synchronous code, those of
+        running loops are closed when they shut down
+        """
+        for loop, (session, guard) in list(self._sessions.items()):
+            if loop.is_closed() or loop.is_running():
+                continue
+            self._sessions.pop(loop, None)
+            loop.run_until_complete(guard.aclose())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def __getstate__(self):
+        # engines are sent to the workers of a process pool (see `executor`)
+        # without the session and the cache handler of this process, nor the
+        # domain and user agent lists, which the workers read themselves
+        state = dict(self.__dict__)
+        state.update(_sessions={}, _cache_handler=None)
+        if state.get("domain_list") is get_domains():
+            del state["domain_list"]
+        if state.get("agent_list") is get_user_agents():
+            del state["agent_list"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "domain_list" not in state:
+            self.domain_list = get_domains()
+        if "agent_list" not in state:
+            self.agent_list = get_user_agents()
+
+    async def get_source(self, url, cache=True, max_bytes=None, content_types=None, serp=False):
         """
         Returns the source code of a webpage.
         Also sets the _cache_hit if cache was used
 
         :rtype: string
         :param url: URL to pull it's source code
+        :param max_bytes: stop downloading the body after this many bytes
+        :type max_bytes: int
+        :param content_types: mime types to download, see `utils.CacheHandler.get_source`
+        :type content_types: set[str]
+        :param serp: whether `url` is a search, throttled by the limit of the engine
+        :type serp: bool
         :param proxy: proxy address to make use off
         :type proxy: str
         :param proxy_auth: (user, password) tuple to authenticate proxy
         :type proxy_auth: (str, str)
         :return: html source code of a given URL.
         """
-        # get random headers
-
-        # try:
+        policy = self.retry_policy
         html, cache_hit = None, False
-        for i in range(1, 4):
+        for attempt in range(policy.attempts):
+            retry_after = None
             try:
-                html, cache_hit = await self.cache_handler.get_source(self.name, url, self.headers(), cache, self.proxy)
+                session = await self.get_session()
+                html, cache_hit = await self.cache_handler.get_source(
+                    self.name, url, self.headers(), cache, self.proxy, session=session,
+                    retry_statuses=policy.statuses, max_bytes=max_bytes,
+                    content_types=content_types, limits=self.get_limits(url, serp=serp))
                 if html:
                     break
-            except BaseException as e: # jump wrong case
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # jump wrong case
                 print(">" * 30, "exception:", e)
                 print("URL:", url)
+                if not policy.should_retry(e):
+                    break
+                retry_after = getattr(e, "retry_after", None)
+            if attempt + 1 < policy.attempts:
                 print("Try again...")
-                time.sleep(i)
+                metrics.count("retries")
+                await asyncio.sleep(policy.get_timeout(attempt, retry_after=retry_after))
 
         # except:
         if not html:
             print(">" * 10, "failed to scrape `{}`".format(url))
             print("html", html)
+            metrics.count("fetch_failures")
 
         self._cache_hit = cache_hit
         return html
 
+    def get_hedge_url(self, url):
+        """
+        URL of the same search on another domain, None when there is no other
+        domain or `url` is not on one (e.g a custom `url`)
+
+        :rtype: str or None
+        """
+        parsed = urlparse(url)
+        if parsed.netloc not in self.domain_list or len(self.domain_list) < 2:
+            return None
+        if self.domain_scheduling:
+            domain = self.domain_scheduler.choose(exclude=(parsed.netloc,))
+        else:
+            domain = random.choice([d for d in self.domain_list if d != parsed.netloc])
+        return parsed._replace(netloc=domain).geturl()
+
+    async def get_serp_source(self, url, cache=True):
+        """
+        Returns the source code of a SERP. With `hedging`, a search slower
+        than the `hedge_quantile` of the latencies of the engine is sent to
+        another domain too, and the first source code is used.
+
+        :return: source code, whether it comes from the cache, URL it comes
+            from and seconds it took
+        :rtype: (str, bool, str, float)
+        """
+        async def fetch(fetch_url):
+            started = time.monotonic()
+            html = await self.get_source(fetch_url, cache=cache, serp=True)
+            return html, self._cache_hit, fetch_url, time.monotonic() - started
+
+        policy = self.hedge_policy if self.hedging else None
+        delay = policy.delay() if policy is not None else None
+        if delay is None:
+            source = await fetch(url)
+        else:
+            source = await self._hedged_fetch(fetch, url, delay, policy)
+        html, cache_hit, _, latency = source
+        if policy is not None and not cache_hit:
+            policy.record(latency if html else None)
+        return source
+
+    async def _hedged_fetch(self, fetch, url, delay, policy):
+        started = time.monotonic()
+        primary = asyncio.ensure_future(fetch(url))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        hedge_url = None if done else self.get_hedge_url(url)
+        if hedge_url is None or not policy.spend():
+            return await primary
+
+        print("Hedging slow search: {}".format(url))
+        metrics.count("hedges")
+        tasks = [primary, asyncio.ensure_future(fetch(hedge_url))]
+        started_at = {primary: started, tasks[1]: time.monotonic()}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=tasks.index):
+                    if task.result()[0]:
+                        return task.result()
+            # neither search got a source code
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+                if self.domain_scheduling:
+                    # the abandoned search was at least this slow
+                    domain = urlparse(url if task is primary else hedge_url).netloc
+                    self.domain_scheduler.report_latency(domain, time.monotonic() - started_at[task])
+            if pending:
+                await asyncio.wait(pending)
+
     async def get_soup(self, url, cache):
         """
         Get the html soup of a query
@@ -191,8 +618,16 @@ class BaseSearch:
 
         :rtype: `bs4.element.ResultSet`
         """
-        html = await self.get_source(url, cache)
-        return BeautifulSoup(html, 'lxml') if html else None
+        html = await self.get_source(url, cache, serp=True)
+        return await executor.run(self.make_soup, html, picklable=False) if html else None
+
+    def make_soup(self, html):
+        """
+        Parses the source code of a SERP, restricted to `result_strainer`
+
+        :rtype: `bs4.BeautifulSoup`
+        """
+        return BeautifulSoup(html, 'lxml', parse_only=self.result_strainer)
 
     def get_search_url(self, query=None, page=None, **kwargs):
         """
@@ -202,9 +637,16 @@ class BaseSearch:
         offset = (page * 10) - 9
 
         params = self.get_params(query=query, page=page, offset=offset, **kwargs)
-        base_url = "https://" + random.choice(self.domain_list)
-        # base_url = "https://www.google.com/"
-        search_url = urljoin(base_url, "search")
+        if self.search_url:
+            # engines with a search URL of their own
+            search_url = self.search_url
+        else:
+            if self.domain_scheduling:
+                base_url = "https://" + self.domain_scheduler.choose()
+            else:
+                base_url = "https://" + random.choice(self.domain_list)
+            # base_url = "https://www.google.com/"
+            search_url = urljoin(base_url, "search")
         url = urlparse(search_url)
         # For localization purposes, custom urls can be parsed for the same engine
         # such as google.de and google.com
@@ -240,61 +682,248 @@ class BaseSearch:
         search_results = self.parse_result(results, **kwargs)
         return search_results
 
+    def get_parse_cache_key(self, kind, html, **kwargs):
+        """
+        Key of the cached parse of a source code: engine, kind of parse, parser
+        version, hash of the source code and the parameters of the search
+        """
+        params = {k: v for k, v in kwargs.items() if k not in PAGE_CACHE_IGNORED_PARAMS and v is not None}
+        return json.dumps({
+            "engine": self.name,
+            "kind": kind,
+            "parser_version": self.parser_version,
+            "html": hashlib.sha256(html.encode("utf-8")).hexdigest(),
+            "params": params,
+        }, sort_keys=True, default=str)
+
+    def get_cached_parse(self, kind, html, **kwargs):
+        """
+        Looks up the cached parse of a source code when `parse_cache` is set
+
+        :return: key of the parse (None without `parse_cache`), and the cached
+            parse as a `cache.CacheEntry` or None
+        :rtype: (str, `cache.CacheEntry`)
+        """
+        if not self.parse_cache:
+            return None, None
+        key = self.get_parse_cache_key(kind, html, **kwargs)
+        return key, self.cache_handler.get_parse(key, self.name)
+
+    def extract_entries(self, html, **kwargs):
+        """
+        Parses the source code of a SERP into entries, or None when it
+        contains no result. Does not use the cache, and may run in a worker
+        of `executor`.
+
+        :rtype: list or None
+        """
+        results = self.parse_soup(self.make_soup(html))
+        if not results:
+            return None
+
+        entries = []
+        for each in results:
+            entry = self.parse_entry(each, **kwargs)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    async def aparse_entries(self, html, **kwargs):
+        """
+        Parses the source code of a SERP into entries (see `parse_entry`), or
+        None when it contains no result. The source code is parsed on the
+        shared executor (see `executor.set_executor`). With `parse_cache`
+        entries are cached by source code and parser version, so a cached
+        SERP is parsed only once.
+
+        :rtype: list or None
+        """
+        if not html:
+            return None
+
+        key, cached = self.get_cached_parse("serp", html, **kwargs)
+        if cached is not None:
+            metrics.count("parse_cache_hits")
+            return copy.deepcopy(cached.value)
+
+        # parsing sets engine state (e.g the page type of Google), a copy
+        # keeps concurrent searches apart
+        with metrics.timer("serp_parse"):
+            entries = await executor.run(copy.copy(self).extract_entries, html, **kwargs)
+        if entries is not None and key is not None:
+            self.cache_handler.set_parse(key, copy.deepcopy(entries), self.name)
+        return entries
+
+    async def aget_source_results(self, html, num_pages, **kwargs):
+        """ Get results from the source code of a SERP in async mode"""
+
+        entries = await self.aparse_entries(html, **kwargs)
+
+        if entries is None:
+            print(">" * 10 + "ENGINE FAILURE: {}\n".format(self.name))
+            metrics.count("engine_failures")
+            return [{"title": None, "page": None}]
+
+        return await self.acomplete_entries(entries, num_pages)
+
+    async def aget_results(self, soup, **kwargs):
+        """ Get results from soup in async mode"""
+
+        results = self.parse_soup(soup)
+
+        if not results:
+            print(">" * 10 + "ENGINE FAILURE: {}\n".format(self.name))
+            return [{"title": None, "page": None}]
+
+        search_results = await self.aparse_result(results, **kwargs)
+        return search_results
+
+    def get_page_cache_key(self, query, page=1, end_year=None, **kwargs):
+        """
+        Key of the cached search results of a query. Results are cached for the
+        engine, whitespace-normalized query, page, end year, search parameters
+        and parser version; every topk up to the number of cached results is
+        served from the same entry.
+
+        :rtype: str
+        """
+        params = {k: v for k, v in kwargs.items() if k not in PAGE_CACHE_IGNORED_PARAMS and v is not None}
+        return json.dumps({
+            "engine": self.name,
+            "query": " ".join(query.split()),
+            "page": page,
+            "end_year": end_year,
+            "params": params,
+            "parser_version": self.parser_version,
+        }, sort_keys=True, default=str)
+
     def search(self, query=None, page=1, retry=1, cache=True, page_cache=True, topk=1, end_year=None, **kwargs):
         """
         Query the search engine
         """
-        self.end_year = end_year
-        # Pages can only be from 1-N
+        loop = utils.get_event_loop()
+        return loop.run_until_complete(self.asearch(
+            query, page, retry, cache=cache, page_cache=page_cache, topk=topk, end_year=end_year, **kwargs))
 
-        # load cache
-        encoded_query = query.encode("utf-8")
-        query_hash = hashlib.sha256(encoded_query).hexdigest()
-        cache_path = os.path.join(self.page_cache_path, query_hash)
-
-        if page_cache and os.path.exists(cache_path):
-            with open(cache_path, 'rb') as stream:
-                search_results = list(pickle.load(stream))
-                if isinstance(search_results, list) and len(search_results) >= topk and \
-                    isinstance(search_results[topk-1], dict) and isinstance(search_results[topk-1]['page'], str):
-                    print(">>> Using Page Cache")
-                    return search_results[topk-1]
+    async def asearch(self, query=None, page=1, retry=1, cache=True, page_cache=True, topk=1, end_year=None,
+                      **kwargs):
+        """
+        Query the search engine in async mode, takes the same arguments as `search`
 
+        :param query: the query to search for
+        :type query: str
+        :param page: Page to be displayed, defaults to 1
+        :type page: int
+        :param retry: number of searches to retry without cache when no page is found
+        :type retry: int
+        :param cache: use cached source code of SERPs and pages
+        :type cache: bool
+        :param page_cache: use cached search results
+        :type page_cache: bool
+        :param topk: rank of the result to return
+        :type topk: int
+        :param end_year: only search for results until this year
+        :type end_year: int
+        :return: dictionary. Containing title, link, description and page of the topk-th result,
+            and with `attach_metrics` the timings and counters of the search.
+        """
+        if metrics.current() is not None:
+            # retry, or search made by a search: part of the metrics of the outer one
+            return await self._asearch(query, page, retry, cache, page_cache, topk, end_year, **kwargs)
+
+        with metrics.collect(self.name) as search_metrics:
+            metrics.count("searches")
+            with metrics.timer("search"):
+                result = await self._asearch(query, page, retry, cache, page_cache, topk, end_year, **kwargs)
+        if self.attach_metrics:
+            # copy, the result may be cached
+            result = dict(result, metrics=search_metrics.as_dict())
+        return result
+
+    async def _asearch(self, query, page, retry, cache, page_cache, topk, end_year, **kwargs):
+        """ `asearch` within the metrics of the search """
+        self.end_year = end_year
+        # Pages can only be from 1-N
         if page <= 0:
             page = 1
 
-        # Get search Page Results
-        loop = asyncio.get_event_loop()
+        # load cache
+        cache_key = self.get_page_cache_key(query, page=page, end_year=end_year, **kwargs)
+        cached_results = None
+        legacy = False
+        if page_cache:
+            with metrics.timer("page_cache"):
+                cached_results = self.cache_handler.get_page(cache_key, self.name)
+                if cached_results is None and self.legacy_page_cache:
+                    cached_results = self.cache_handler.get_page(query)
+                    legacy = cached_results is not None
+        if cached_results is not None:
+            search_results = list(cached_results)
+            if len(search_results) >= topk and self.is_found(search_results[topk-1]):
+                print(">>> Using Page Cache")
+                metrics.count("page_cache_hits")
+                if legacy:
+                    # migrated to the current key, which is read first
+                    self.cache_handler.set_page(cache_key, tuple(search_results), self.name)
+                # copy, the cached results may be shared in memory
+                return dict(search_results[topk-1])
 
         # construct url
-        url = self.get_search_url(
-                    query, page, **kwargs)
+        with metrics.timer("url"):
+            url = self.get_search_url(
+                        query, page, end_year=end_year, **kwargs)
 
-        soup = loop.run_until_complete(
-            self.get_soup(url, cache=cache))
+        with metrics.timer("serp_fetch"):
+            html, cache_hit, url, latency = await self.get_serp_source(url, cache=cache)
 
-        res = self.get_results(soup, num_pages=topk, **kwargs)
+        res = await self.aget_source_results(html, num_pages=topk, **kwargs)
+        if self.domain_scheduling and not self.search_url and not cache_hit:
+            # no source code, or no results (ENGINE FAILURE) e.g on a CAPTCHA page
+            failed = not html or res == [{"title": None, "page": None}]
+            self.domain_scheduler.report(urlparse(url).netloc, not failed, latency if html else None)
 
         # retry
-        if retry and ((len(res) < topk or not res[topk-1]["page"]) or isinstance(res[topk-1]["page"], list)):
+        if retry and (len(res) < topk or not self.is_found(res[topk-1])):
             print("Failed url: {}".format(url))
             print("Retrying without loading cache {} ...".format(retry))
-            return self.search(query, page, retry - 1, cache=False, page_cache=page_cache, topk=topk, end_year=end_year)
+            metrics.count("search_retries")
+            return await self._asearch(query, page, retry - 1, False, page_cache, topk, end_year, **kwargs)
 
         if len(res) < topk:
-            return {"page": "No evidence found, please change query."}
+            return dict(NO_EVIDENCE)
        
         # save cache
-        if res[topk-1]["page"]:
-            with open(cache_path, 'wb') as stream:
-                pickle.dump(tuple(res), stream)
+        if self.is_found(res[topk-1]):
+            self.cache_handler.set_page(cache_key, tuple(res), self.name)
+
+        # copy, the results are now cached in memory
+        return dict(res[topk - 1])
+
+    def search_many(self, queries, concurrency=10, **kwargs):
+        """
+        Query the search engine for many queries concurrently, see `asearch_many`
+        """
+        loop = utils.get_event_loop()
+        return loop.run_until_complete(self.asearch_many(queries, concurrency=concurrency, **kwargs))
 
-        return res[topk - 1]
-    
+    async def asearch_many(self, queries, concurrency=10, **kwargs):
+        """
+        Query the search engine for many queries concurrently
+
+        :param queries: queries to search for
+        :type queries: list[str]
+        :param concurrency: maximum number of searches in flight
+        :type concurrency: int
+        :param kwargs: arguments of `asearch` shared by every query
+        :return: results of `asearch`, in the order of the queries
+        :rtype: list[dict]
+        """
+        return await asearch_many([(self, query) for query in queries], concurrency=concurrency, **kwargs)
 
     async def async_search(self, query=None, page=1, cache=True, **kwargs):
         """
-        Query the search engine but in async mode
+        Query the search engine but in async mode and return every result of the
+        SERP. Prefer `asearch`, which also uses the page cache and retries.
 
         :param query: the query to search for
         :type query: str
@@ -310,4 +939,41 @@ class BaseSearch:
         if page == 0:
             page = 1
         soup = await self.get_soup(self.get_search_url(query, page, **kwargs), cache=cache)
-        return self.get_results(soup, **kwargs)
+        kwargs.setdefault("num_pages", 10)
+        return await self.aget_results(soup, **kwargs)
+
+
+async def asearch_many(jobs, concurrency=10, return_exceptions=False, **kwargs):
+    """
+    Runs many searches concurrently, possibly across engines
+
+    :param jobs: (engine, query) pairs, or (engine, query, kwargs) triples whose
+        kwargs override the shared ones
+    :type jobs: list[tuple]
+    :param concurrency: maximum number of searches in flight
+    :type concurrency: int
+    :param return_exceptions: return the exception of a failed search as its result
+        instead of raising it
+    :type return_exceptions: bool
+    :param kwargs: arguments of `BaseSearch.asearch` shared by every job
+    :return: results of `BaseSearch.asearch`, in the order of the jobs
+    :rtype: list[dict]
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        engine, query = job[:2]
+        job_kwargs = dict(kwargs, **job[2]) if len(job) > 2 else kwargs
+        async with semaphore:
+            return await engine.asearch(query, **job_kwargs)
+
+    return await asyncio.gather(*[run(job) for job in jobs], return_exceptions=return_exceptions)
+
+
+def search_many(jobs, concurrency=10, return_exceptions=False, **kwargs):
+    """
+    Runs many searches concurrently from synchronous code, see `asearch_many`
+    """
+    loop = utils.get_event_loop()
+    return loop.run_until_complete(
+        asearch_many(jobs, concurrency=concurrency, return_exceptions=return_exceptions, **kwargs))
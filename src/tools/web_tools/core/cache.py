@@ -0,0 +1,488 @@
+"""@desc
+		Storage backends of the cache handler
+"""
+
+import os
+import json
+import time
+import pickle
+import struct
+import sqlite3
+import hashlib
+import tempfile
+import argparse
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # optional, entries are compressed with zlib without it
+    zstandard = None
+
+
+# header of an encoded entry: magic, codec, kind of value, HTTP status (0 if
+# unknown) and fetch time, followed by the compressed body
+MAGIC = b"WTC1"
+HEADER = struct.Struct("<4sBBHd")
+
+CODECS = {"none": 0, "zlib": 1, "zstd": 2}
+CODEC_NAMES = {v: k for k, v in CODECS.items()}
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+# text values (HTML) are stored as UTF-8, other values (search results) as UTF-8 JSON
+KINDS = {"text": 0, "json": 1}
+KIND_NAMES = {v: k for k, v in KINDS.items()}
+
+
+def hash_key(key):
+    """ Name of a cache entry: sha256 of its key """
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def write_atomic(path, data):
+    """
+    Writes `data` to a temporary file renamed to `path`, so that readers (of
+    any process) see either the previous file or the whole new one
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def compress(data, codec, level=None):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    return data
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd compressed cache entries")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return bytes(data)
+
+
+def value_kind(value):
+    return "text" if isinstance(value, str) else "json"
+
+
+def encode_entry(value, status=None, fetched_at=None, codec=DEFAULT_CODEC, level=None):
+    """
+    Encodes a value as a header followed by its compressed body
+
+    :rtype: bytes
+    """
+    kind = value_kind(value)
+    data = value if kind == "text" else json.dumps(value)
+    header = HEADER.pack(MAGIC, CODECS[codec], KINDS[kind], status or 0,
+                         time.time() if fetched_at is None else fetched_at)
+    return header + compress(data.encode("utf-8"), codec, level)
+
+
+def read_header(data):
+    """
+    Decodes the header of an encoded entry, None for data of another format
+
+    :return: codec, kind, status and fetch time
+    :rtype: tuple
+    """
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        return None
+    _, codec, kind, status, fetched_at = HEADER.unpack_from(data)
+    return CODEC_NAMES[codec], KIND_NAMES[kind], status or None, fetched_at
+
+
+class CacheEntry:
+    """
+    A cached value with the time it was stored, and the HTTP status and headers
+    of the response it comes from (None when unknown). Compressed values are
+    only decoded when `value` is first accessed.
+    """
+
+    __slots__ = ("_value", "_body", "_codec", "_kind", "fetched_at", "status", "headers")
+
+    def __init__(self, value=None, fetched_at=None, status=None, headers=None,
+                 body=None, codec=None, kind=None):
+        self._value = value
+        self._body = body
+        self._codec = codec
+        self._kind = kind
+        self.fetched_at = fetched_at
+        self.status = status
+        self.headers = headers
+
+    @classmethod
+    def decode(cls, data, headers=None):
+        """ Entry of data encoded by `encode_entry`, None for data of another format """
+        header = read_header(data)
+        if header is None:
+            return None
+        codec, kind, status, fetched_at = header
+        return cls(fetched_at=fetched_at, status=status, headers=headers,
+                   body=memoryview(data)[HEADER.size:], codec=codec, kind=kind)
+
+    @property
+    def value(self):
+        if self._body is not None:
+            data = decompress(self._body, self._codec).decode("utf-8")
+            self._value = data if self._kind == "text" else json.loads(data)
+            self._body = None
+        return self._value
+
+    def __repr__(self):
+        return "CacheEntry(fetched_at={}, status={})".format(self.fetched_at, self.status)
+
+
+class FileCacheStore:
+    """
+    Stores every entry as a file named by the hash of its key, in one directory
+    per namespace. Entries are written as encoded entries (see `encode_entry`);
+    pickle files of older caches are still read until they are migrated.
+    Files are replaced atomically, so the store can be shared by several
+    processes.
+    """
+
+    def __init__(self, root, codec=DEFAULT_CODEC):
+        self.root = root
+        self.codec = codec
+        self._dirs = set()
+
+    def namespace_path(self, namespace):
+        path = os.path.join(self.root, namespace)
+        if path not in self._dirs:
+            os.makedirs(path, exist_ok=True)
+            self._dirs.add(path)
+        return path
+
+    def get(self, namespace, key):
+        """
+        :rtype: `CacheEntry` or None
+        """
+        path = os.path.join(self.namespace_path(namespace), hash_key(key))
+        try:
+            with open(path, 'rb') as stream:
+                data = stream.read()
+        except FileNotFoundError:
+            return None
+        entry = CacheEntry.decode(data)
+        if entry is None:
+            # pickle file of an older cache
+            try:
+                entry = CacheEntry(pickle.loads(data), os.path.getmtime(path))
+            except (pickle.UnpicklingError, EOFError):
+                # truncated by a writer of an older version, fetched again
+                return None
+        return entry
+
+    def get_header(self, namespace, key):
+        """
+        Reads the codec, kind, status and fetch time of an entry without its body,
+        None when missing or not migrated
+        """
+        path = os.path.join(self.namespace_path(namespace), hash_key(key))
+        try:
+            with open(path, 'rb') as stream:
+                return read_header(stream.read(HEADER.size))
+        except FileNotFoundError:
+            return None
+
+    def set(self, namespace, key, value, status=None, headers=None):
+        path = os.path.join(self.namespace_path(namespace), hash_key(key))
+        write_atomic(path, encode_entry(value, status=status, codec=self.codec))
+
+    def migrate(self, namespaces=None):
+        """
+        Rewrites the pickle files of the given namespaces, or of every namespace,
+        as encoded entries
+
+        :return: number of migrated entries per namespace
+        """
+        if namespaces is None:
+            namespaces = [d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d))]
+        counts = {}
+        for namespace in namespaces:
+            counts[namespace] = 0
+            with os.scandir(self.namespace_path(namespace)) as it:
+                for f in it:
+                    if not f.is_file() or f.name.endswith(".tmp"):
+                        continue
+                    with open(f.path, 'rb') as stream:
+                        data = stream.read()
+                    if read_header(data) is not None:
+                        continue
+                    try:
+                        value = pickle.loads(data)
+                    except (pickle.UnpicklingError, EOFError):
+                        print("Skipping unreadable cache file: {}".format(f.path))
+                        continue
+                    if isinstance(value, tuple):
+                        value = list(value)
+                    write_atomic(f.path, encode_entry(value, fetched_at=f.stat().st_mtime, codec=self.codec))
+                    counts[namespace] += 1
+        return counts
+
+    def clear(self, namespaces=None):
+        """
+        Removes the entries of the given namespaces, or of every namespace
+        """
+        if namespaces is None:
+            namespaces = [d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d))]
+        for namespace in namespaces:
+            path = os.path.join(self.root, namespace)
+            if not os.path.isdir(path):
+                continue
+            with os.scandir(path) as it:
+                for f in it:
+                    # temporary files belong to writes in progress
+                    if f.is_file() and not f.name.endswith(".tmp"):
+                        try:
+                            os.remove(f.path)
+                        except FileNotFoundError:
+                            pass
+
+
+class SQLiteCacheStore:
+    """
+    Stores every entry as a row of a single SQLite database in WAL mode, with
+    the encoded value (see `encode_entry`) along with its fetch time, status
+    and headers
+    """
+
+    def __init__(self, path, codec=DEFAULT_CODEC, compress_level=None):
+        self.path = path
+        self.codec = codec
+        self.compress_level = compress_level
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, kind TEXT NOT NULL, value BLOB NOT NULL, "
+            "fetched_at REAL, status INTEGER, headers TEXT, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        self._conn.commit()
+
+
+    def get(self, namespace, key):
+        """
+        :rtype: `CacheEntry` or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, headers FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, hash_key(key))).fetchone()
+        if row is None:
+            return None
+        blob, headers = row
+        return CacheEntry.decode(blob, headers=json.loads(headers) if headers else None)
+
+    def set(self, namespace, key, value, status=None, headers=None):
+        self._insert([(namespace, hash_key(key), value, None, status, headers)])
+
+    def _insert(self, rows):
+        records = []
+        for namespace, hashed, value, fetched_at, status, headers in rows:
+            fetched_at = fetched_at or time.time()
+            blob = encode_entry(value, status=status, fetched_at=fetched_at, codec=self.codec,
+                                level=self.compress_level)
+            records.append((namespace, hashed, value_kind(value), blob, fetched_at, status,
+                            json.dumps(dict(headers)) if headers else None))
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+            self._conn.commit()
+
+    def clear(self, namespaces=None):
+        """
+        Removes the entries of the given namespaces, or of every namespace
+        """
+        with self._lock:
+            if namespaces is None:
+                self._conn.execute("DELETE FROM entries")
+            else:
+                self._conn.executemany("DELETE FROM entries WHERE namespace = ?",
+                                       [(namespace,) for namespace in namespaces])
+            self._conn.commit()
+
+    def import_pickle_dir(self, directory, namespace, batch_size=1000):
+        """
+        Imports the entries of a `FileCacheStore` namespace directory, keeping
+        their hashed keys (pickle files get their modification time as fetch time)
+
+        :return: number of imported entries
+        """
+        count, batch = 0, []
+        with os.scandir(directory) as it:
+            for f in it:
+                if not f.is_file() or f.name.endswith(".tmp"):
+                    continue
+                with open(f.path, 'rb') as stream:
+                    data = stream.read()
+                entry = CacheEntry.decode(data)
+                if entry is None:
+                    try:
+                        entry = CacheEntry(pickle.loads(data), f.stat().st_mtime)
+                    except (pickle.UnpicklingError, EOFError):
+                        print("Skipping unreadable cache file: {}".format(f.path))
+                        continue
+                value = entry.value
+                if isinstance(value, tuple):
+                    value = list(value)
+                batch.append((namespace, f.name, value, entry.fetched_at, entry.status, None))
+                if len(batch) >= batch_size:
+                    self._insert(batch)
+                    count += len(batch)
+                    batch = []
+        if batch:
+            self._insert(batch)
+            count += len(batch)
+        return count
+
+    def import_file_cache(self, root):
+        """
+        Imports every namespace directory of a `FileCacheStore`
+
+        :return: number of imported entries per namespace
+        """
+        counts = {}
+        for namespace in sorted(os.listdir(root)):
+            directory = os.path.join(root, namespace)
+            if os.path.isdir(directory):
+                counts[namespace] = self.import_pickle_dir(directory, namespace)
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LRUCacheStore:
+    """
+    In-memory tier in front of another store: keeps the most recently used
+    entries up to `max_bytes`, for at most `ttl` seconds (forever if None)
+    """
+
+    def __init__(self, store, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(value):
+        return len(value) if isinstance(value, str) else len(json.dumps(value))
+
+    def get(self, namespace, key):
+        """
+        :rtype: `CacheEntry` or None
+        """
+        with self._lock:
+            item = self._entries.get((namespace, key))
+            if item is not None:
+                entry, size, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end((namespace, key))
+                    self.hits += 1
+                    return entry
+                del self._entries[(namespace, key)]
+                self.size -= size
+            self.misses += 1
+        entry = self.store.get(namespace, key)
+        if entry is not None:
+            self._remember(namespace, key, entry)
+        return entry
+
+    def set(self, namespace, key, value, status=None, headers=None):
+        self.store.set(namespace, key, value, status=status, headers=headers)
+        self._remember(namespace, key, CacheEntry(value, time.time(), status, headers))
+
+    def _remember(self, namespace, key, entry):
+        size = self.sizeof(entry.value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            old = self._entries.pop((namespace, key), None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[(namespace, key)] = (entry, size, expires_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self, namespaces=None):
+        with self._lock:
+            if namespaces is None:
+                self._entries.clear()
+                self.size = 0
+            else:
+                for cache_key in [k for k in self._entries if k[0] in namespaces]:
+                    self.size -= self._entries.pop(cache_key)[1]
+        self.store.clear(namespaces)
+
+    def stats(self):
+        """ Hit/miss counters and memory usage of the tier """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "bytes": self.size}
+
+    def __getattr__(self, name):
+        # store specific methods, e.g `migrate` or `import_file_cache`
+        if name == "store":
+            raise AttributeError(name)
+        return getattr(self.store, name)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Cache maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="Import a pickle cache directory (e.g core/cache) into an SQLite cache")
+    import_parser.add_argument("src", help="Directory of the pickle cache")
+    import_parser.add_argument("db", help="Path of the SQLite cache database")
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Rewrite the pickle files of a cache directory as compressed entries")
+    migrate_parser.add_argument("src", help="Directory of the pickle cache")
+    for subparser in (import_parser, migrate_parser):
+        subparser.add_argument("--codec", choices=sorted(CODECS), default=DEFAULT_CODEC,
+                               help="Compression of the entries (default: %(default)s)")
+    return parser
+
+
+def main(args):
+    if args.command == "import":
+        store = SQLiteCacheStore(args.db, codec=args.codec)
+        counts = store.import_file_cache(args.src)
+        store.close()
+    elif args.command == "migrate":
+        counts = FileCacheStore(args.src, codec=args.codec).migrate()
+    for namespace, count in counts.items():
+        print("{}: {} entries".format(namespace, count))
+
+
+if __name__ == '__main__':
+    main(create_parser().parse_args())
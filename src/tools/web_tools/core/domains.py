@@ -0,0 +1,241 @@
+"""@desc
+		Health-aware choice of the domain a search is sent to
+"""
+import time
+import random
+import threading
+from collections import deque
+
+
+class DomainStats:
+    """ Health of a domain: moving averages of its success rate and latency """
+
+    __slots__ = ("success", "latency", "failures", "cooldown_until", "probe")
+
+    def __init__(self):
+        # optimistic until proven otherwise, so that every domain gets tried
+        self.success = 1.0
+        self.latency = None
+        self.failures = 0
+        self.cooldown_until = 0.0
+        # whether to try the domain once as soon as its cooldown is over
+        self.probe = False
+
+
+class DomainScheduler:
+    """
+    Chooses the domain of each search among `domains`, preferring fast
+    domains that answer with results. A domain failing (no source code,
+    e.g CAPTCHA or 429 after retries, or a SERP without results) is put in
+    cooldown, doubled on each consecutive failure, and is tried once again
+    when the cooldown is over. Otherwise, two domains not in cooldown are
+    drawn at random and the healthier one is used ("power of two choices"),
+    which spreads the load while avoiding slow domains.
+
+    :param domains: domains to choose from
+    :type domains: tuple[str]
+    :param cooldown: seconds a domain is not used after a failure
+    :type cooldown: float
+    :param max_cooldown: upper bound of the cooldown after consecutive failures
+    :type max_cooldown: float
+    :param alpha: weight of the last outcome in the moving averages
+    :type alpha: float
+    :param clock: returns the current time in seconds
+    :type clock: callable
+    """
+
+    def __init__(self, domains, cooldown=60.0, max_cooldown=900.0, alpha=0.3, clock=time.monotonic):
+        self.domains = domains
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self.clock = clock
+        self._stats = {domain: DomainStats() for domain in domains}
+        self._lock = threading.Lock()
+
+    def score(self, stats, default_latency):
+        """ Higher is better: success rate per second of latency """
+        latency = stats.latency if stats.latency is not None else default_latency
+        return stats.success / max(latency, 0.05)
+
+    def choose(self, exclude=()):
+        """
+        Returns the domain to send the next search to
+
+        :param exclude: domains not to choose, unless there is no other one
+        :type exclude: collection[str]
+        :rtype: str
+        """
+        with self._lock:
+            now = self.clock()
+            domains = [d for d in self.domains if d not in exclude] or self.domains
+            available = [d for d in domains if self._stats[d].cooldown_until <= now]
+            if not available:
+                # every domain is cooling down: use the one available first
+                return min(domains, key=lambda d: self._stats[d].cooldown_until)
+            for domain in available:
+                if self._stats[domain].probe:
+                    self._stats[domain].probe = False
+                    return domain
+            if len(available) == 1:
+                return available[0]
+
+            latencies = [s.latency for s in self._stats.values() if s.latency is not None]
+            # unknown domains are expected to be as fast as the average one
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            first, second = random.sample(available, 2)
+            if self.score(self._stats[second], default_latency) > self.score(self._stats[first], default_latency):
+                return second
+            return first
+
+    def report(self, domain, success, latency=None):
+        """
+        Records the outcome of a search sent to `domain`
+
+        :param domain: domain the search was sent to
+        :type domain: str
+        :param success: whether results were found
+        :type success: bool
+        :param latency: seconds taken to get the source code of the SERP
+        :type latency: float
+        """
+        with self._lock:
+            stats = self._stats.get(domain)
+            if stats is None:
+                return
+            stats.success += self.alpha * (float(success) - stats.success)
+            if latency is not None:
+                stats.latency = latency if stats.latency is None \
+                    else stats.latency + self.alpha * (latency - stats.latency)
+            if success:
+                stats.failures = 0
+                stats.cooldown_until = 0.0
+            else:
+                stats.failures += 1
+                cooldown = min(self.cooldown * 2 ** (stats.failures - 1), self.max_cooldown)
+                stats.cooldown_until = self.clock() + cooldown
+                stats.probe = True
+
+    def report_latency(self, domain, latency):
+        """
+        Records a lower bound of the latency of `domain`, e.g of a search
+        abandoned for a faster one, without changing its success rate
+        """
+        with self._lock:
+            stats = self._stats.get(domain)
+            if stats is None:
+                return
+            stats.latency = latency if stats.latency is None \
+                else stats.latency + self.alpha * (max(latency, stats.latency) - stats.latency)
+
+    def stats(self):
+        """
+        Health of every domain that has been reported on
+
+        :rtype: dict
+        """
+        with self._lock:
+            now = self.clock()
+            return {
+                domain: {
+                    "success": stats.success,
+                    "latency": stats.latency,
+                    "failures": stats.failures,
+                    "cooldown": max(0.0, stats.cooldown_until - now),
+                }
+                for domain, stats in self._stats.items()
+                if stats.latency is not None or stats.failures or stats.success < 1.0
+            }
+
+
+class HedgePolicy:
+    """
+    When to send a duplicate of a slow search to another domain: once it
+    has taken longer than the `quantile` of the recent latencies of the
+    engine, the first source code of either search is used. Every search
+    sent over the network earns `budget` hedges, so that at most `budget`
+    extra searches are sent per search (up to `burst` at once).
+
+    :param quantile: quantile of the latencies after which a search is hedged
+    :type quantile: float
+    :param budget: extra searches allowed per search
+    :type budget: float
+    :param burst: extra searches that can be saved up
+    :type burst: float
+    :param min_samples: latencies to observe before hedging
+    :type min_samples: int
+    :param window: number of recent latencies the quantile is computed on
+    :type window: int
+    """
+
+    def __init__(self, quantile=0.9, budget=0.1, burst=5, min_samples=20, window=200):
+        self.quantile = quantile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._credit = 0.0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency=None):
+        """
+        Records a search sent over the network, and its latency if it was answered
+        """
+        with self._lock:
+            self._credit = min(self.burst, self._credit + self.budget)
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def delay(self):
+        """
+        Seconds after which a search is hedged, None when too few latencies are known
+
+        :rtype: float or None
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+            return latencies[min(len(latencies) - 1, int(self.quantile * len(latencies)))]
+
+    def spend(self):
+        """ Whether a hedge can be sent, taking it from the budget """
+        with self._lock:
+            if self._credit < 1:
+                return False
+            self._credit -= 1
+            self.hedges += 1
+            return True
+
+
+_schedulers = {}
+_hedge_policies = {}
+
+
+def get_scheduler(name, domains):
+    """
+    Returns the domain scheduler shared by the engines named `name`, created
+    on first use and again when their domains change (see `base.reload_data`)
+
+    :rtype: `DomainScheduler`
+    """
+    scheduler = _schedulers.get(name)
+    if scheduler is None or scheduler.domains is not domains:
+        scheduler = _schedulers[name] = DomainScheduler(domains)
+    return scheduler
+
+
+def get_hedge_policy(name, **kwargs):
+    """
+    Returns the hedging policy shared by the engines named `name`, created
+    on first use with the arguments of `HedgePolicy`, and again when they
+    change
+
+    :rtype: `HedgePolicy`
+    """
+    config, policy = _hedge_policies.get(name, (None, None))
+    if policy is None or config != kwargs:
+        policy = HedgePolicy(**kwargs)
+        _hedge_policies[name] = (kwargs, policy)
+    return policy
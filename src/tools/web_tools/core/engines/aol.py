@@ -2,6 +2,7 @@
 		Parser for AOL search results
 """
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 
 
 class Search(BaseSearch):
@@ -9,6 +10,7 @@ class Search(BaseSearch):
     Searches Aol for string
     """
     name = "AOL"
+    result_strainer = class_strainer("div", "algo-sr")
     search_url = "https://search.aol.com/aol/search?"
     summary = "\t According to netmarketshare, the old time famous AOL is still in the top 10 "\
         "search engines with a market share that is close to 0.06%. "\
@@ -2,6 +2,7 @@
 		Parser for ask search results
 """
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 
 
 class Search(BaseSearch):
@@ -9,6 +10,7 @@ class Search(BaseSearch):
     Searches Ask for string
     """
     name = "Ask"
+    result_strainer = class_strainer("div", "PartialSearchResults-item")
 
     search_url = "https://www.ask.com/web?"
 
@@ -5,6 +5,7 @@
 import re
 
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 
 
 class Search(BaseSearch):
@@ -12,6 +13,7 @@ class Search(BaseSearch):
     Searches Baidu for string
     """
     name = "Baidu"
+    result_strainer = class_strainer("div", "c-container")
     search_url = "https://www.baidu.com/s?"
     summary = "\tBaidu, Inc. is a Chinese multinational technology company specializing in"\
         " Internet-related services and products and artificial intelligence (AI), headquartered"\
@@ -62,5 +64,5 @@ class Search(BaseSearch):
 
         if return_type in (ReturnType.FULL, return_type.DESCRIPTION):
             desc = single_result.find('div', class_='c-abstract')
-            rdict["description"] = desc if desc else ''
+            rdict["description"] = desc.text if desc else ''
             return rdict
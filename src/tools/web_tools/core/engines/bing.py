@@ -2,6 +2,7 @@
 		Parser for Bing search results
 """
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 
 
 class Search(BaseSearch):
@@ -9,6 +10,7 @@ class Search(BaseSearch):
     Searches Bing for string
     """
     name = "Bing"
+    result_strainer = class_strainer("li", "b_algo")
     search_url = "https://www.bing.com/search?"
     summary = "\tBing is Microsoft’s attempt to challenge Google in search, but despite their "\
         "efforts they still did not manage to convince users that their search engine can be"\
@@ -2,6 +2,7 @@
 		Parser for GitHub search results
 """
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 from src.tools.web_tools.core.exceptions import IncorrectKeyWord
 
 
@@ -10,6 +11,9 @@ class Search(BaseSearch):
     Searches GitHub for string
     """
     name = "GitHub"
+    result_strainer = class_strainer(
+        ["li", "div"], "repo-list-item", "hx_hit-package", "user-list-item", "hx_hit-wiki",
+        "topic-list-item", "issue-list-item", "hx_hit-marketplace", "commits-list-item")
     base_url = "https://github.com"
     search_url = base_url + "/search?"
     summary = "\tGitHub is an American company that provides hosting for software development "\
@@ -1,8 +1,6 @@
 """@desc
 		Parser for google search results
 """
-import sys
-import asyncio
 import re
 from urllib.parse import (
     urljoin,
@@ -10,13 +8,18 @@ from urllib.parse import (
     unquote
 )
 import urllib.parse as urlparse
-from fuzzysearch import find_near_matches
 
+from src.tools.web_tools.core import executor
+from src.tools.web_tools.core import utils
+from src.tools.web_tools.core import metrics
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
-from src.tools.web_tools.core.utils import text_from_soup, post_processing, blocked_sites, soup2md
+from src.tools.web_tools.core.matching import NearMatcher, BoundaryIndex
+from src.tools.web_tools.core.utils import class_strainer, text_from_html, post_processing, blocked_sites, soup2md
 
 
 EXTRA_PARAMS = ('hl', 'tbs')
+# characters of page text kept for matching
+MAX_TEXT_LEN = 10000
 
 
 class Search(BaseSearch):
@@ -24,6 +27,19 @@ class Search(BaseSearch):
     Searches Google for string
     """
     name = "Google"
+    result_strainer = class_strainer("div", "Gx5Zad", "ezO2md")
+    # Google serves unusual-traffic pages to bursts of searches
+    rate_limit = 2.0
+    rate_burst = 5
+    max_concurrency = 10
+    concurrent_pages = True
+    fetches_pages = True
+    # results archived by earlier versions were Google searches
+    legacy_page_cache = True
+    # result pages are read up to `page_max_bytes`, and only if they declare
+    # one of `page_content_types` (PDFs, spreadsheets... are not downloaded)
+    page_max_bytes = 2 * 1024 * 1024
+    page_content_types = ("text/html", "application/xhtml+xml", "text/plain")
     base_url = "https://www.google.com/"
     summary = "\tNo need for further introductions. The search engine giant holds the first "\
         "place in search with a stunning difference of 65% from second in place Bing.\n"\
@@ -31,8 +47,8 @@ class Search(BaseSearch):
         "were powered by Google and only 7.91% by Bing.\n\tGoogle is also dominating the "\
         "mobile/tablet search engine market share with 81%!"
 
-    def __init__(self, verbose=False, proxy=None):
-        super(Search, self).__init__(proxy)
+    def __init__(self, verbose=False, proxy=None, cache_handler=None):
+        super(Search, self).__init__(proxy, cache_handler=cache_handler)
 
         # self.domain_list = get_data(file_path=DOMAIN_PATH)
         # self.ua_list = get_data(file_path=self.config.UA_PATH)
@@ -47,8 +63,9 @@ class Search(BaseSearch):
         params = {}
         params["q"] = query
         params["gl"] = "US"
-        if self.end_year:
-            params['tbs']="cdr:1,cd_min:,cd_max:{}".format(self.end_year)
+        end_year = kwargs.get("end_year", self.end_year)
+        if end_year:
+            params['tbs']="cdr:1,cd_min:,cd_max:{}".format(end_year)
         # additional parameters will be considered
         for param in EXTRA_PARAMS:
             if kwargs.get(param):
@@ -82,9 +99,32 @@ class Search(BaseSearch):
 
         :param single_result: single result found in <div class="g">
         :type single_result: `bs4.element.ResultSet`
-        :return: parsed title, link and description of single result
+        :return: parsed title, link, description and page of single result
         :rtype: dict
         """
+        entry = self.parse_entry(single_result, return_type=return_type, **kwargs)
+        if entry is None:
+            return
+        results, fallback_page = entry
+        page = self.parse_page(results.get('link', ""), results.get('description', ""))
+        return self.finish_result(results, page, fallback_page)
+
+    async def acomplete_entry(self, entry):
+        results, fallback_page = entry
+        results = dict(results)
+        page = await self.aparse_page(results.get('link', ""), results.get('description', ""))
+        return self.finish_result(results, page, fallback_page)
+
+    def parse_entry(self, single_result, return_type=ReturnType.FULL, **kwargs):
+        """
+        Parses the source code of a single result without fetching its page
+
+        :param single_result: single result found in <div class="g">
+        :type single_result: `bs4.element.ResultSet`
+        :return: parsed title, link and description of single result, and the
+            page to fall back to when the linked page does not match
+        :rtype: (dict, str)
+        """
         # Some unneeded details shown such as suggestions should be ignore
         if (single_result.find("h2", class_="wITvVb") and single_result.find("div", class_="LKSyXe"))\
                 or single_result.find("div", {"class": ["BmP5tf"]}) or single_result.find("span", class_="qXLe6d x3G5ab") \
@@ -186,84 +226,127 @@ class Search(BaseSearch):
             if site in results.get('link', ""):
                 return
 
-        # if results['link']:
-        results['page'] = self.parse_page(results.get('link', ""), results.get('description', ""))
+        # page to return if no page matches: the description
+        if self.page_type == 1:
+            # get all description
+            els = single_result.find_all('div', class_=['kCrYT', 'CgE3Ac', 'X7NTVe'], recursive=True)
+            all_desc = []
+            for el in els:
+                if el == title_elem:
+                    continue
+                elif el['class'][0] == 'CgE3Ac':
+                    # parse table
+                    desc = soup2md(el).strip()
+                    if len(all_desc) == 0:
+                        desc = "\n" + desc
+                else:
+                    desc = el.get_text(' ', strip=True)
+                    desc_list = [d for d in desc.split("...")]
+                    desc = "...".join(desc_list)
+                    desc = desc.replace("\n", " ").strip()
+                all_desc.append(desc)
+                if self.verbose:
+                    print(">" * 20)
+                    print(el.prettify())
+                    print(desc)
+            fallback_page = "\n".join(all_desc)
+        else:
+            fallback_page = results['description']
+
+        return results, fallback_page
+
+    def finish_result(self, results, page, fallback_page):
+        """
+        Sets the matched page of a parsed result, or its SERP description when
+        the page did not match. Returns None for results without content.
+        """
+        results['page'] = page
 
         if self.verbose:
             print("title:", results.get('title', ""))
-        
-        # if no page: return description
+
         if not results['page']:
-            # get all description
-            if self.page_type == 1:
-                els = single_result.find_all('div', class_=['kCrYT', 'CgE3Ac', 'X7NTVe'], recursive=True)
-                all_desc = []
-                for el in els:
-                    if el == title_elem:
-                        continue
-                    elif el['class'][0] == 'CgE3Ac':
-                        # parse table
-                        desc = soup2md(el).strip()
-                        if len(all_desc) == 0:
-                            desc = "\n" + desc
-                    else:
-                        desc = el.get_text(' ', strip=True)
-                        desc_list = [d for d in desc.split("...")]
-                        desc = "...".join(desc_list)
-                        desc = desc.replace("\n", " ").strip()
-                    all_desc.append(desc)
-                    if self.verbose:
-                        print(">" * 20)
-                        print(el.prettify())
-                        print(desc)
-                results['page'] = "\n".join(all_desc)
-            else:
-                results['page'] = results['description']
-        
+            results['page'] = fallback_page
+
         if len(results['page']) < 10:
             return
 
         return results
 
     def get_match_spans(self, src_text, match_parts):
+        matcher = NearMatcher(src_text)
+        boundaries = BoundaryIndex(src_text, stop_chars="\n\t.}")
         match_spans = []
         for part in match_parts:
-            matchs = find_near_matches(part, src_text, max_l_dist=int(0.1 * len(part))) # fuzzy match
-            if len(matchs) > 0:
-                match = matchs[0]
-
-                stop_char = "\n\t.}"
-                # forward extent to a stop
-                ind = next((i for i, ch in enumerate(src_text[match.end - 1:]) if ch in stop_char), None)
-                end_idx = match.end + ind if ind else match.end
-
-                start_idx = match.start
-                # backward extend to a stop
-                src_text = "." + src_text
-                ind = next((i for i, ch in enumerate(src_text[:match.start + 1][::-1]) if ch in stop_char), None)
-                start_idx = match.start - ind
-
-                match_spans.append([start_idx, end_idx])
+            match = matcher.find_first(part, int(0.1 * len(part))) # fuzzy match
+            if match is not None:
+                # extend to the stops around the match
+                match_spans.append(list(boundaries.expand(match.start, match.end)))
         return match_spans
 
  
     def parse_page(self, url, desc):
+        loop = utils.get_event_loop()
+        return loop.run_until_complete(self.aparse_page(url, desc))
+
+    async def aparse_page(self, url, desc):
+        """
+        Fetches the page of a result and returns its parts matching the description
+        """
         if not url or not desc:
             return
 
         if self.verbose:
             print("-" * 10)
             print("Get page: {}".format(url))
-        loop = asyncio.get_event_loop()
-        soup = loop.run_until_complete(
-            self.get_soup(url, cache=True))
-
-        if not soup or not soup.body:
+        with metrics.timer("page_fetch"):
+            html = await self.get_source(url, cache=True, max_bytes=self.page_max_bytes,
+                                         content_types=self.page_content_types)
+        if not html:
             return
 
-        MAX_TEXT_LEN = 10000
-        text = text_from_soup(soup)
-        text = post_processing(text)[:MAX_TEXT_LEN]
+        # text extraction and matching run on the shared executor
+        key, cached = self.get_cached_parse("page", html)
+        if cached is not None:
+            metrics.count("parse_cache_hits")
+            with metrics.timer("matching"):
+                return await executor.run(self.match_page, cached.value, desc)
+        text, match, timings = await executor.run(self.match_source, html, desc)
+        for stage, seconds in timings.items():
+            metrics.record(stage, seconds)
+        if key is not None:
+            self.cache_handler.set_parse(key, text, self.name)
+        return match
+
+    def extract_page_text(self, html):
+        """ Extracts the paragraphs of a page, None when it has no body """
+        text = text_from_html(html)
+        if text is not None:
+            text = post_processing(text)[:MAX_TEXT_LEN]
+        return text
+
+    def match_source(self, html, desc):
+        """
+        Extracts the text of a page and matches it against the description,
+        in one call so that a worker of `executor` does both
+
+        :return: text of the page, its parts matching the description, and
+            the seconds taken by each stage
+        :rtype: (str, str, dict)
+        """
+        timings = {}
+        with metrics.stopwatch(timings, "text_extraction"):
+            text = self.extract_page_text(html)
+        with metrics.stopwatch(timings, "matching"):
+            match = self.match_page(text, desc)
+        return text, match, timings
+
+    def match_page(self, text, desc):
+        """
+        Returns the parts of the text of a page matching the description
+        """
+        if text is None:
+            return
 
         if self.verbose:
             print("text:", text[:4000])
@@ -5,6 +5,7 @@
 import re
 
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 
 
 class Search(BaseSearch):
@@ -12,6 +13,11 @@ class Search(BaseSearch):
     Searches Google Scholar for string
     """
     name = "GoogleScholar"
+    result_strainer = class_strainer("div", "gs_r")
+    # Scholar blocks much sooner than Google search
+    rate_limit = 0.5
+    rate_burst = 2
+    max_concurrency = 2
     search_url = "https://scholar.google.gr/scholar?"
     summary = "\tGoogle Scholar is a freely accessible web search engine that indexes the full "\
         "text or metadata of scholarly literature across an array of publishing formats and "\
@@ -2,6 +2,7 @@
 		Parser for AOL search results
 """
 from src.tools.web_tools.core.base import BaseSearch, ReturnType
+from src.tools.web_tools.core.utils import class_strainer
 
 
 class Search(BaseSearch):
@@ -9,6 +10,7 @@ class Search(BaseSearch):
     Searches StackOverflow for string
     """
     name = "StackOverflow"
+    result_strainer = class_strainer("div", "summary")
     base_url = "https://stackoverflow.com"
     search_url = base_url + "/search?"
     summary = "\tStack Overflow is a question and answer site for professional and enthusiast "\
@@ -12,3 +12,23 @@ class NoResultsOrTrafficError(Exception):
 
 class IncorrectKeyWord(Exception):
     """ When a wrong keyword argument is passed to the search function """
+
+
+class HTTPStatusError(Exception):
+    """ When a request is answered with a status that should be retried """
+
+    def __init__(self, url, status, retry_after=None):
+        super().__init__("HTTP {} for {}".format(status, url))
+        self.url = url
+        self.status = status
+        # seconds to wait before retrying, as announced by the server
+        self.retry_after = retry_after
+
+
+class ContentRejected(Exception):
+    """ When a response is not downloaded because of its content type """
+
+    def __init__(self, url, content_type):
+        super().__init__("Content type {} rejected for {}".format(content_type, url))
+        self.url = url
+        self.content_type = content_type
@@ -0,0 +1,63 @@
+"""@desc
+		Executor the CPU-bound work of the searches (HTML parsing, fuzzy
+		matching) is offloaded to, keeping the event loop free for network I/O
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+_executor = None
+# whether `_executor` was created by `set_executor`, and is shut down by it
+_owned = False
+
+
+def get_executor():
+    """
+    Returns the executor shared by every engine, None when the work is done
+    on the event loop
+
+    :rtype: `concurrent.futures.Executor` or None
+    """
+    return _executor
+
+
+def set_executor(executor=None, max_workers=None):
+    """
+    Replaces the executor shared by every engine. A process pool lets one
+    process use several cores: engines and arguments are then pickled, and
+    functions must be importable by the workers. None runs the work on the
+    event loop again.
+
+    :param executor: executor, or "thread" / "process" for a new pool
+    :type executor: `concurrent.futures.Executor` or str
+    :param max_workers: number of workers of a new pool
+    :type max_workers: int
+    """
+    global _executor, _owned
+    previous, owned = _executor, _owned
+    if executor == "thread":
+        executor, _owned = ThreadPoolExecutor(max_workers), True
+    elif executor == "process":
+        executor, _owned = ProcessPoolExecutor(max_workers), True
+    else:
+        _owned = False
+    _executor = executor
+    if owned and previous is not None:
+        previous.shutdown(wait=False)
+
+
+async def run(func, *args, picklable=True, **kwargs):
+    """
+    Runs `func(*args, **kwargs)` on the shared executor, or right away when
+    there is none. Results that are not `picklable` (e.g soups) are computed
+    in a thread of the event loop when the executor is a process pool.
+    """
+    executor = _executor
+    if executor is None:
+        return func(*args, **kwargs)
+    if not picklable and isinstance(executor, ProcessPoolExecutor):
+        # default executor of the loop
+        executor = None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
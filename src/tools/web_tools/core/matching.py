@@ -0,0 +1,244 @@
+"""@desc
+		Fuzzy matching of snippets against the text of a page
+"""
+
+import re
+from bisect import bisect_left
+from collections import Counter
+
+from fuzzysearch import find_near_matches
+from fuzzysearch.common import Match, consolidate_overlapping_matches
+
+
+def expand_short(subsequence, sequence, max_l_dist):
+    """
+    `expand` for short subsequences, computing the distance matrix one cell at
+    a time (same as `fuzzysearch.levenshtein_ngram._py_expand_short`, which is
+    private to fuzzysearch)
+    """
+    subseq_len = len(subsequence)
+    if subseq_len == 0:
+        return 0, 0
+
+    # scores of skipping the first characters of the subsequence
+    scores = list(range(1, subseq_len + 1))
+    min_score = subseq_len
+    min_score_idx = -1
+    for seq_index, char in enumerate(sequence):
+        # each score is the minimum of a substitution (a), a deletion (b) and
+        # an insertion (c)
+        a = seq_index
+        c = a + 1
+        for subseq_index in range(subseq_len):
+            b = scores[subseq_index]
+            c = scores[subseq_index] = min(a + (char != subsequence[subseq_index]), b + 1, c + 1)
+            a = b
+
+        # keep the longest prefix with the smallest distance
+        if c <= min_score:
+            min_score = c
+            min_score_idx = seq_index
+        # no prefix can do better
+        elif min(scores) >= min_score:
+            break
+
+    return (min_score, min_score_idx + 1) if min_score <= max_l_dist else (None, None)
+
+
+def expand(subsequence, sequence, max_l_dist):
+    """
+    Expand a partial match, same as `fuzzysearch.levenshtein_ngram._expand`:
+    smallest Levenshtein distance between `subsequence` and a prefix of
+    `sequence` and the length of the longest such prefix, or (None, None) if
+    the distance is larger than `max_l_dist`.
+
+    Long subsequences use the bit-parallel algorithm of Myers (as extended by
+    Hyyrö to edit distance), which computes a column of the distance matrix
+    with a handful of integer operations instead of a loop over its cells.
+    """
+    subseq_len = len(subsequence)
+    if subseq_len <= max(max_l_dist * 2, 10):
+        return expand_short(subsequence, sequence, max_l_dist)
+
+    peq = {}
+    for i, char in enumerate(subsequence):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    mask = (1 << subseq_len) - 1
+    last = 1 << (subseq_len - 1)
+
+    # vertical deltas of the first column are all +1
+    pv, mv = mask, 0
+    score = min_score = subseq_len
+    min_score_idx = 0
+    for seq_index, char in enumerate(sequence):
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # horizontal deltas of the first row are all +1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        if score <= min_score:
+            min_score = score
+            min_score_idx = seq_index + 1
+
+    return (min_score, min_score_idx) if min_score <= max_l_dist else (None, None)
+
+
+class NearMatcher:
+    """
+    Finds near matches of snippets in the text of a page in two stages:
+    exact occurrences of n-grams of a snippet are looked up in an index of
+    the page to find candidate windows, windows sharing too few q-grams with
+    the snippet are discarded, and the occurrences in the remaining windows
+    are expanded with a bounded Levenshtein distance. Results are the same as
+    searching the whole text with `fuzzysearch.find_near_matches`.
+
+    :param text: text of the page
+    :type text: str
+    :param q: length of the q-grams of the index
+    :type q: int
+    """
+
+    def __init__(self, text, q=3):
+        self.text = text
+        self.q = q
+        # q-gram at every position of the text, and positions of every q-gram
+        self.grams = [text[i:i + q] for i in range(len(text) - q + 1)]
+        self.positions = {}
+        for i, gram in enumerate(self.grams):
+            self.positions.setdefault(gram, []).append(i)
+
+    def occurrences(self, ngram, start, end):
+        """ Start positions in [start, end) of exact occurrences of an n-gram (len >= q) """
+        text, q = self.text, self.q
+        return [i for i in self.positions.get(ngram[:q], ()) if start <= i < end
+                and (len(ngram) == q or text.startswith(ngram, i))]
+
+    def seeds(self, part, max_l_dist):
+        """
+        Exact occurrences of the n-grams of `part`, as (ngram_start, index)
+        in the order `fuzzysearch` expands them.
+
+        By the pigeonhole principle, a match with at most `max_l_dist` edits
+        contains one of `max_l_dist + 1` consecutive n-grams of `part` exactly.
+        """
+        part_len, text_len = len(part), len(self.text)
+        ngram_len = part_len // (max_l_dist + 1)
+        for ngram_start in range(0, part_len - ngram_len + 1, ngram_len):
+            ngram_end = ngram_start + ngram_len
+            start = max(0, ngram_start - max_l_dist)
+            end = min(text_len, text_len - part_len + ngram_end + max_l_dist)
+            for index in self.occurrences(part[ngram_start:ngram_end], start, end - ngram_len + 1):
+                yield ngram_start, index
+
+    def candidate_windows(self, part, max_l_dist, seeds):
+        """
+        Group seeds into disjoint windows of the text, in order, as
+        (start, end, seeds). The window of a seed covers every match it can
+        expand to, so matches in different windows never overlap.
+        """
+        part_len, text_len = len(part), len(self.text)
+        windows = []
+        for order, (ngram_start, index) in enumerate(seeds):
+            align = index - ngram_start
+            windows.append((max(0, align - max_l_dist), min(text_len, align + part_len + max_l_dist), order))
+
+        merged = []
+        for start, end, order in sorted(windows):
+            if merged and start < merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+                merged[-1][2].append(order)
+            else:
+                merged.append([start, end, [order]])
+        # seeds of a window keep the order they are expanded in
+        return [(start, end, [seeds[order] for order in sorted(orders)]) for start, end, orders in merged]
+
+    def may_match(self, part, max_l_dist, start, end):
+        """
+        q-gram lemma: a match with at most `max_l_dist` edits shares at least
+        len(part) - q + 1 - max_l_dist * q q-grams with `part`
+        """
+        threshold = len(part) - self.q + 1 - max_l_dist * self.q
+        if threshold <= 0:
+            return True
+        part_grams = Counter(part[i:i + self.q] for i in range(len(part) - self.q + 1))
+        window_grams = Counter(self.grams[start:max(start, end - self.q + 1)])
+        return sum((part_grams & window_grams).values()) >= threshold
+
+    def expand_seeds(self, part, max_l_dist, seeds):
+        """ Matches of `part` expanded from seeds, as `find_near_matches_levenshtein_ngrams` """
+        text, part_len = self.text, len(part)
+        ngram_len = part_len // (max_l_dist + 1)
+        for ngram_start, index in seeds:
+            dist_right, right_expand_size = expand(
+                part[ngram_start + ngram_len:],
+                text[index + ngram_len:index - ngram_start + part_len + max_l_dist],
+                max_l_dist,
+            )
+            if dist_right is None:
+                continue
+            dist_left, left_expand_size = expand(
+                part[:ngram_start][::-1],
+                text[max(0, index - ngram_start - (max_l_dist - dist_right)):index][::-1],
+                max_l_dist - dist_right,
+            )
+            if dist_left is None:
+                continue
+            start, end = index - left_expand_size, index + ngram_len + right_expand_size
+            yield Match(start, end, dist_left + dist_right, matched=text[start:end])
+
+    def find_first(self, part, max_l_dist):
+        """
+        First near match of `part` in the text, i.e `find_near_matches(...)[0]`
+
+        :rtype: `fuzzysearch.Match` or None
+        """
+        if max_l_dist == 0 or len(part) // (max_l_dist + 1) < self.q:
+            # no n-gram long enough to seed from
+            matches = find_near_matches(part, self.text, max_l_dist=max_l_dist)
+            return matches[0] if matches else None
+
+        seeds = list(self.seeds(part, max_l_dist))
+        for start, end, window_seeds in self.candidate_windows(part, max_l_dist, seeds):
+            if not self.may_match(part, max_l_dist, start, end):
+                continue
+            matches = consolidate_overlapping_matches(self.expand_seeds(part, max_l_dist, window_seeds))
+            if matches:
+                return matches[0]
+        return None
+
+
+class BoundaryIndex:
+    """
+    Sorted positions of the stop characters of a text, to extend a span to
+    the sentence around it with a binary search instead of scanning the text
+
+    :param text: text of the page
+    :type text: str
+    :param stop_chars: characters ending a sentence
+    :type stop_chars: str
+    """
+
+    def __init__(self, text, stop_chars="\n\t.}"):
+        self.stops = [m.start() for m in re.finditer("[{}]".format(re.escape(stop_chars)), text)]
+
+    def expand(self, start, end):
+        """
+        Extends [start, end) backward to the character following the previous
+        stop (or the start of the text) and forward to the next stop, included
+        (or keeps `end` if there is none)
+        """
+        stops = self.stops
+        i = bisect_left(stops, start)
+        start = stops[i - 1] + 1 if i > 0 else 0
+        i = bisect_left(stops, end - 1)
+        end = stops[i] + 1 if i < len(stops) else end
+        return start, end
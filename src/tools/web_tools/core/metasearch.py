@@ -0,0 +1,113 @@
+"""@desc
+		Searching several engines at once for the same query
+"""
+import asyncio
+from urllib.parse import urlparse
+
+from src.tools.web_tools.core import utils
+
+
+def link_key(link):
+    """ Key deduplicating links: without scheme, "www.", fragment and trailing slash """
+    parsed = urlparse(link)
+    netloc = parsed.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    key = netloc + parsed.path.rstrip("/")
+    return key + "?" + parsed.query if parsed.query else key
+
+
+def tag_result(result, engine):
+    """ Copy of a result with the name of the engine it comes from """
+    result = dict(result)
+    result["engine"] = engine.name
+    return result
+
+
+async def asearch_first(engines, query, **kwargs):
+    """
+    Searches every engine concurrently and returns the first result found
+    (see `BaseSearch.is_found`: with a page for the engines fetching pages,
+    the title, link and description otherwise), cancelling the other
+    searches. When no engine finds one, the result of the first engine (in
+    the given order) is returned.
+
+    :param engines: engines to search, in order of preference
+    :type engines: list[`base.BaseSearch`]
+    :param query: the query to search for
+    :type query: str
+    :param kwargs: arguments of `BaseSearch.asearch`
+    :return: result of `BaseSearch.asearch` with the name of its engine as `engine`
+    :rtype: dict
+    :raises: the exception of the first engine when every search fails
+    """
+    tasks = [asyncio.ensure_future(engine.asearch(query, **kwargs)) for engine in engines]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # the preferred engine wins a tie
+            for task in sorted(done, key=tasks.index):
+                engine = engines[tasks.index(task)]
+                if not task.exception() and engine.is_found(task.result()):
+                    return tag_result(task.result(), engine)
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+    for engine, task in zip(engines, tasks):
+        if not task.exception():
+            return tag_result(task.result(), engine)
+    raise tasks[0].exception()
+
+
+async def asearch_merged(engines, query, return_exceptions=False, **kwargs):
+    """
+    Searches every engine concurrently and merges their results found (see
+    `BaseSearch.is_found`), keeping the first of the results with the same link
+
+    :param engines: engines to search, in order of preference
+    :type engines: list[`base.BaseSearch`]
+    :param query: the query to search for
+    :type query: str
+    :param return_exceptions: skip the engines whose search fails instead of
+        raising their exception
+    :type return_exceptions: bool
+    :param kwargs: arguments of `BaseSearch.asearch`
+    :return: results of `BaseSearch.asearch` with the name of their engine as
+        `engine`, in the order of the engines
+    :rtype: list[dict]
+    """
+    results = await asyncio.gather(*[engine.asearch(query, **kwargs) for engine in engines],
+                                   return_exceptions=return_exceptions)
+    merged = []
+    seen = set()
+    for engine, result in zip(engines, results):
+        if isinstance(result, BaseException) or not engine.is_found(result):
+            continue
+        if result.get("link"):
+            key = link_key(result["link"])
+            if key in seen:
+                continue
+            seen.add(key)
+        merged.append(tag_result(result, engine))
+    return merged
+
+
+def search_first(engines, query, **kwargs):
+    """
+    Returns the first result with a page from synchronous code, see `asearch_first`
+    """
+    loop = utils.get_event_loop()
+    return loop.run_until_complete(asearch_first(engines, query, **kwargs))
+
+
+def search_merged(engines, query, return_exceptions=False, **kwargs):
+    """
+    Merges the results of several engines from synchronous code, see `asearch_merged`
+    """
+    loop = utils.get_event_loop()
+    return loop.run_until_complete(
+        asearch_merged(engines, query, return_exceptions=return_exceptions, **kwargs))
@@ -0,0 +1,225 @@
+"""@desc
+		Timings and counters of the stages of the searches
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from src.tools.web_tools.core.cache import write_atomic
+
+
+# upper bounds (seconds) of the buckets of the stage timings
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class SearchMetrics:
+    """
+    Timings and counters of one search. The time of a stage is summed over
+    its operations, e.g over the pages fetched concurrently.
+    """
+
+    __slots__ = ("engine", "stages", "counters")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.stages = {}
+        self.counters = {}
+
+    def as_dict(self):
+        return {"stages": dict(self.stages), "counters": dict(self.counters)}
+
+
+class Histogram:
+    """ Number of observations per bucket, their count and their sum """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Aggregates the timings and counters of every search, by engine
+
+    :param buckets: upper bounds of the buckets of the stage timings
+    :type buckets: tuple[float]
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, engine, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get((engine, stage))
+            if histogram is None:
+                histogram = self._stages[(engine, stage)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def incr(self, engine, counter, value=1):
+        with self._lock:
+            self._counters[(engine, counter)] = self._counters.get((engine, counter), 0) + value
+
+    def snapshot(self):
+        """
+        Stage timings (count, sum) and counters by engine
+
+        :rtype: dict
+        """
+        with self._lock:
+            snapshot = {}
+            for (engine, stage), histogram in self._stages.items():
+                stages = snapshot.setdefault(engine, {"stages": {}, "counters": {}})["stages"]
+                stages[stage] = {"count": histogram.count, "sum": histogram.sum}
+            for (engine, counter), value in self._counters.items():
+                snapshot.setdefault(engine, {"stages": {}, "counters": {}})["counters"][counter] = value
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def to_prometheus(self, prefix="web_tools"):
+        """
+        The metrics in the Prometheus text format: a histogram of the stage
+        timings, and a counter per counter name
+
+        :rtype: str
+        """
+        with self._lock:
+            lines = []
+            if self._stages:
+                name = prefix + "_stage_seconds"
+                lines.append("# HELP {} Time spent in each stage of the searches".format(name))
+                lines.append("# TYPE {} histogram".format(name))
+                for (engine, stage), histogram in sorted(self._stages.items()):
+                    labels = 'engine="{}",stage="{}"'.format(escape_label(engine), escape_label(stage))
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+                    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, histogram.count))
+                    lines.append("{}_sum{{{}}} {}".format(name, labels, histogram.sum))
+                    lines.append("{}_count{{{}}} {}".format(name, labels, histogram.count))
+
+            counters = {}
+            for (engine, counter), value in self._counters.items():
+                counters.setdefault(counter, []).append((engine, value))
+            for counter in sorted(counters):
+                name = "{}_{}_total".format(prefix, counter)
+                lines.append("# TYPE {} counter".format(name))
+                for engine, value in sorted(counters[counter]):
+                    lines.append('{}{{engine="{}"}} {}'.format(name, escape_label(engine), value))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write_prometheus(self, path, prefix="web_tools"):
+        """ Writes `to_prometheus` to a file atomically, e.g for the textfile collector of node_exporter """
+        write_atomic(path, self.to_prometheus(prefix).encode("utf-8"))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_registry = MetricsRegistry()
+# metrics of the search running in the current context (see `collect`)
+_current = contextvars.ContextVar("search_metrics", default=None)
+
+
+def get_registry():
+    """ Returns the metrics registry shared by every engine """
+    return _registry
+
+
+def set_registry(registry):
+    """
+    Replaces the metrics registry shared by every engine. None resets to a
+    new, empty registry.
+    """
+    global _registry
+    _registry = registry if registry is not None else MetricsRegistry()
+
+
+def current():
+    """
+    Returns the metrics of the search running in the current context, None
+    outside of a search
+
+    :rtype: `SearchMetrics` or None
+    """
+    return _current.get()
+
+
+@contextmanager
+def collect(engine):
+    """
+    Collects the metrics of a search: stages and counters recorded in the
+    context, including the tasks it creates, are added to the yielded
+    `SearchMetrics`
+
+    :param engine: name of the engine searching
+    :type engine: str
+    """
+    metrics = SearchMetrics(engine)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def record(stage, seconds, engine=None):
+    """ Adds the time of a stage to the current search and to the registry """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.stages[stage] = metrics.stages.get(stage, 0.0) + seconds
+        engine = metrics.engine
+    _registry.observe(engine or "unknown", stage, seconds)
+
+
+def count(counter, value=1, engine=None):
+    """ Increments a counter of the current search and of the registry """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[counter] = metrics.counters.get(counter, 0) + value
+        engine = metrics.engine
+    _registry.incr(engine or "unknown", counter, value)
+
+
+@contextmanager
+def timer(stage, engine=None):
+    """ Records the time spent in the block as `stage`, see `record` """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started, engine)
+
+
+@contextmanager
+def stopwatch(timings, stage):
+    """
+    Adds the time spent in the block to `timings[stage]`, for work done
+    outside of the context of the search (e.g in a worker of `executor`)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
@@ -0,0 +1,312 @@
+"""@desc
+		Throttling of requests, shared by every engine of the process
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import deque
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, and bursts of up to
+    `burst`. Callers wait for their turn in order; the bucket can be used
+    from several event loops.
+
+    :param rate: tokens added per second
+    :type rate: float
+    :param burst: capacity of the bucket
+    :type burst: int
+    :param clock: returns the current time in seconds
+    :type clock: callable
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ Takes a token, possibly in advance: returns the seconds to wait before using it """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self):
+        """ Gives back a token that was not used """
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def configure(self, rate, burst=1):
+        """ Changes the rate and the capacity, keeping the tokens taken """
+        with self._lock:
+            self.rate = rate
+            self.burst = burst
+            self._tokens = min(burst, self._tokens)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.refund()
+                raise
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    `TokenBucket` whose tokens are kept in an SQLite database, so that every
+    process using the same database and `name` shares the same budget
+
+    :param path: path of the database
+    :type path: str
+    :param name: name of the bucket in the database
+    :type name: str
+    :param clock: returns the current time in seconds, the same in every process
+    :type clock: callable
+    """
+
+    def __init__(self, path, name, rate, burst=1, clock=time.time):
+        super().__init__(rate, burst, clock)
+        self.path = path
+        self.name = name
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # transactions are handled by `_update`
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # a crash may lose the last updates, which only refills the buckets
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+            "updated REAL NOT NULL)")
+
+    def _update(self, taken):
+        """ Refills the bucket and takes `taken` tokens from it, returns the tokens left """
+        with self._lock:
+            if self._conn is None:
+                # closed while an acquisition was in progress, e.g on a new
+                # configuration (see `get_limit`)
+                return 0.0
+            # the write lock is taken right away, other processes wait for it
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?",
+                                         (self.name,)).fetchone()
+                now = self.clock()
+                tokens = float(self.burst) if row is None \
+                    else min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+                tokens = min(self.burst, tokens - taken)
+                self._conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                                   (self.name, tokens, now))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return tokens
+
+    def reserve(self):
+        tokens = self._update(1)
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def refund(self):
+        self._update(-1)
+
+    async def acquire(self):
+        # the database may be locked by other processes for a while: its
+        # updates run in threads, not on the event loop
+        loop = asyncio.get_running_loop()
+        reserved = loop.run_in_executor(None, self.reserve)
+        try:
+            wait = await asyncio.shield(reserved)
+        except asyncio.CancelledError:
+            # the token is taken anyway, give it back once it is
+            reserved.add_done_callback(
+                lambda _: not reserved.cancelled() and reserved.exception() is None
+                and loop.run_in_executor(None, self.refund))
+            raise
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                await loop.run_in_executor(None, self.refund)
+                raise
+
+    def configure(self, rate, burst=1):
+        # the tokens are in the database
+        with self._lock:
+            self.rate = rate
+            self.burst = burst
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ConcurrencyLimit:
+    """
+    Semaphore of at most `limit` holders which, unlike `asyncio.Semaphore`,
+    can be shared by several event loops, and whose limit can be changed
+
+    :param limit: maximum number of concurrent holders, None is unlimited
+    :type limit: int
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._holders = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free() and not self._waiters:
+                self._holders += 1
+                return
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            # the slot is handed over by `release`
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+                    raise
+            # cancelled after the slot was handed over
+            self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            # unless the limit was lowered, the slot goes to a waiter and the
+            # number of holders is unchanged
+            if self.limit is None or self._holders <= self.limit:
+                while self._waiters:
+                    loop, waiter = self._waiters.popleft()
+                    if not loop.is_closed():
+                        loop.call_soon_threadsafe(_hand_over, waiter)
+                        return
+            self._holders -= 1
+
+    def set_limit(self, limit):
+        """ Changes the limit, current holders keep their slot """
+        with self._lock:
+            self.limit = limit
+            while self._waiters and self._free():
+                loop, waiter = self._waiters.popleft()
+                if not loop.is_closed():
+                    self._holders += 1
+                    loop.call_soon_threadsafe(_hand_over, waiter)
+
+    def _free(self):
+        return self.limit is None or self._holders < self.limit
+
+
+def _hand_over(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Limit:
+    """
+    Async context manager throttling a kind of requests: at most
+    `max_concurrency` at a time, and `rate` per second with bursts of
+    `burst`. None disables either limit. The rate is shared with other
+    processes when `bucket` is a `SharedTokenBucket`.
+    """
+
+    def __init__(self, rate=None, burst=1, max_concurrency=None, bucket=None):
+        self.config = None
+        self.bucket = None
+        self.concurrency = ConcurrencyLimit(None)
+        if bucket is None and rate:
+            bucket = TokenBucket(rate, burst)
+        self.configure(rate, burst, max_concurrency, bucket)
+
+    def configure(self, rate=None, burst=1, max_concurrency=None, bucket=None):
+        """
+        Changes the configuration in place, so that the requests in progress
+        and the new ones share the same caps. A replaced `SharedTokenBucket`
+        is closed.
+
+        :param bucket: token bucket of the rate, None if `rate` is None
+        :type bucket: `TokenBucket`
+        """
+        if isinstance(self.bucket, SharedTokenBucket) and self.bucket is not bucket:
+            self.bucket.close()
+        if bucket is not None:
+            bucket.configure(rate, burst)
+        self.bucket = bucket
+        self.concurrency.set_limit(max_concurrency or None)
+        self.config = (rate, burst, max_concurrency)
+
+    async def __aenter__(self):
+        await self.concurrency.acquire()
+        bucket = self.bucket
+        if bucket is not None:
+            try:
+                await bucket.acquire()
+            except BaseException:
+                self.concurrency.release()
+                raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.concurrency.release()
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+# database of the buckets shared with other processes, see `set_shared_path`
+_shared_path = None
+
+
+def set_shared_path(path):
+    """
+    Shares the request rates of every limit with the other processes using
+    the same SQLite database, e.g the workers of a deployment on one machine.
+    Concurrency caps stay per process. None goes back to per process rates.
+
+    :param path: path of the database
+    :type path: str
+    """
+    global _shared_path
+    with _limits_lock:
+        _shared_path = path
+
+
+def get_limit(key, rate=None, burst=1, max_concurrency=None):
+    """
+    Returns the limit shared by the requests of `key`, e.g ("engine", "Google")
+    or ("host", "en.wikipedia.org"), created on first use and reconfigured
+    in place when its configuration or the shared path changes
+
+    :rtype: `Limit`
+    """
+    config = (rate, burst, max_concurrency)
+    with _limits_lock:
+        limit = _limits.get(key)
+        if limit is None:
+            limit = _limits[key] = Limit()
+        shared_path = _shared_path if rate else None
+        bucket = limit.bucket
+        if limit.config != config or getattr(bucket, "path", None) != shared_path:
+            if not rate:
+                bucket = None
+            elif bucket is None or getattr(bucket, "path", None) != shared_path:
+                bucket = SharedTokenBucket(shared_path, ":".join(key), rate, burst) \
+                    if shared_path is not None else TokenBucket(rate, burst)
+            limit.configure(rate, burst, max_concurrency, bucket)
+        return limit
@@ -1,15 +1,22 @@
 import os
 import re
+import time
+import asyncio
 import random
-import pickle
-import hashlib
+from contextlib import AsyncExitStack
+from email.utils import parsedate_to_datetime
+
 import aiohttp
 from aiohttp_retry import RetryClient, ExponentialRetry
 from src.tools.web_tools.markdownify import MarkdownConverter
+from src.tools.web_tools.core import metrics
+from src.tools.web_tools.core.cache import FileCacheStore, LRUCacheStore
+from src.tools.web_tools.core.exceptions import HTTPStatusError, ContentRejected
 
 from fake_useragent import UserAgent
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from bs4.element import Comment
+from lxml import etree
 
 
 FILEPATH = os.path.dirname(os.path.abspath(__file__))
@@ -41,23 +48,127 @@ def get_rand_user_agent():
     return user_agent
     
 
+class RetryPolicy(ExponentialRetry):
+    """
+    Retry policy of `BaseSearch.get_source`: exponential backoff with jitter,
+    honoring the Retry-After header of throttled responses
+
+    :param attempts: maximum number of attempts
+    :param start_timeout: seconds to wait before the first retry
+    :param max_timeout: maximum seconds to wait between two attempts
+    :param factor: how much the wait grows after each attempt
+    :param jitter: fraction of the wait that is randomized, so that concurrent
+        requests failing together do not retry together
+    :param statuses: HTTP statuses to retry on
+    :param exceptions: exceptions to retry on, all of them if empty
+    :param retry_all_server_errors: retry on every 5xx status
+    """
+
+    def __init__(self, attempts=3, start_timeout=1.0, max_timeout=30.0, factor=2.0, jitter=0.5,
+                 statuses=(429,), exceptions=None, retry_all_server_errors=True):
+        statuses = set(statuses)
+        if retry_all_server_errors:
+            statuses.update(range(500, 600))
+        super().__init__(attempts=attempts, start_timeout=start_timeout, max_timeout=max_timeout,
+                         factor=factor, statuses=statuses, exceptions=exceptions,
+                         retry_all_server_errors=retry_all_server_errors)
+        self.jitter = jitter
+
+    def should_retry(self, exc):
+        """ Whether an exception raised by an attempt is worth another attempt """
+        if isinstance(exc, HTTPStatusError):
+            return exc.status in self.statuses
+        if isinstance(exc, ContentRejected):
+            return False
+        return not self.exceptions or isinstance(exc, tuple(self.exceptions))
+
+    def get_timeout(self, attempt, response=None, retry_after=None):
+        """
+        Seconds to wait after the failed attempt number `attempt` (0-based)
+        """
+        timeout = super().get_timeout(attempt, response)
+        timeout *= 1 - self.jitter * random.random()
+        if retry_after is not None:
+            timeout = max(timeout, min(retry_after, self._max_timeout))
+        return timeout
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait according to a Retry-After header, given either in seconds
+    or as an HTTP date. Returns None when missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
 class CacheHandler:
-    def __init__(self):
-        self.cache = os.path.join(FILEPATH, "cache")
+    def __init__(self, cache_dir=None, store=None, memory_bytes=64 * 1024 * 1024, memory_ttl=None):
+        """
+        :param cache_dir: directory of the cache, defaults to `core/cache`
+        :type cache_dir: str
+        :param store: storage backend, defaults to one file per entry under `cache_dir`
+        :type store: `cache.FileCacheStore` or `cache.SQLiteCacheStore`
+        :param memory_bytes: size of the in-memory tier in front of the store, 0 disables it
+        :type memory_bytes: int
+        :param memory_ttl: seconds entries stay in the in-memory tier, forever if None
+        :type memory_ttl: float
+        """
+        self.cache = cache_dir or os.path.join(FILEPATH, "cache")
         engine_path = os.path.join(FILEPATH, "engines")
-        if not os.path.exists(self.cache):
-            os.makedirs(self.cache)
+        os.makedirs(self.cache, exist_ok=True)
         enginelist = os.listdir(engine_path)
-        self.engine_cache = {i[:-3]: os.path.join(self.cache, i[:-3]) for i in enginelist if i not in
-                             ("__init__.py")}
-        for cache in self.engine_cache.values():
-            if not os.path.exists(cache):
-                os.makedirs(cache)
+        self.engine_cache = {i[:-3]: os.path.join(self.cache, i[:-3]) for i in enginelist
+                             if i.endswith(".py") and i != "__init__.py"}
+        # search results of `BaseSearch.search`
+        self.page_cache = os.path.join(self.cache, "pages")
+        self.store = store if store is not None else FileCacheStore(self.cache)
+        if memory_bytes:
+            self.store = LRUCacheStore(self.store, max_bytes=memory_bytes, ttl=memory_ttl)
+        # downloads in progress by (engine, url), shared by concurrent callers
+        self._in_flight = {}
+
+    def get_page(self, key, engine=None):
+        """
+        Returns the cached search results of a search of `engine`, or None.
+        Without engine, the results cached under the bare query by earlier versions.
+        """
+        entry = self.store.get(namespace("pages", engine), key)
+        return entry.value if entry is not None else None
+
+    def set_page(self, key, results, engine=None):
+        """ Caches the search results of a search, unless they cannot be serialized """
+        try:
+            self.store.set(namespace("pages", engine), key, results)
+        except (TypeError, ValueError) as e:
+            print(">" * 10, "results not cached:", e)
+
+    def get_parse(self, key, engine=None):
+        """
+        Returns the cached parse of a source code as a `cache.CacheEntry`, or None
+        """
+        return self.store.get(namespace("parses", engine), key)
+
+    def set_parse(self, key, value, engine=None):
+        """ Caches the parse of a source code, unless it cannot be serialized """
+        try:
+            self.store.set(namespace("parses", engine), key, value)
+        except (TypeError, ValueError):
+            pass
 
     async def get_source(self, engine, url, headers, cache=True,
-                        proxy=None, proxy_auth=None):
+                        proxy=None, proxy_auth=None, session=None, retry_statuses=(),
+                        max_bytes=None, content_types=None, limits=()):
         """
-        Retrieves source code of webpage from internet or from cache
+        Retrieves source code of webpage from internet or from cache.
+        Concurrent calls for the same URL share a single download.
 
         :rtype: str, bool
         :param engine: engine of the engine saving
@@ -72,48 +183,203 @@ class CacheHandler:
         :type proxy: str
         :param proxy_auth: (user, password) tuple to authenticate proxy
         :type proxy_auth: (str, str)
+        :param session: pooled session to fetch with, a one-off session is opened if None
+        :type session: `aiohttp.ClientSession`
+        :param retry_statuses: statuses raising `HTTPStatusError` instead of being cached
+        :type retry_statuses: set[int]
+        :param max_bytes: stop reading the body after this many bytes, read it all if None
+        :type max_bytes: int
+        :param content_types: mime types to download, other declared types raise
+            `ContentRejected` before the body is read. Anything is downloaded if None
+        :type content_types: set[str]
+        :param limits: throttling of the download, not applied to cache hits
+        :type limits: list[`ratelimit.Limit`]
         """
-        encodedUrl = url.encode("utf-8")
-        urlhash = hashlib.sha256(encodedUrl).hexdigest()
-        engine = engine.lower()
-        cache_path = os.path.join(self.engine_cache[engine], urlhash)
+        # metrics are labelled with the name of the engine, as by `BaseSearch`
+        name, engine = engine, engine.lower()
         # load cache
-        if os.path.exists(cache_path) and cache:
-            with open(cache_path, 'rb') as stream:
-                return pickle.load(stream), True
+        if cache:
+            with metrics.timer("cache", name):
+                entry = self.store.get(engine, url)
+            if entry is not None:
+                metrics.count("cache_hits", engine=name)
+                return entry.value, True
+            metrics.count("cache_misses", engine=name)
 
         get_vars = { 'url':url, 'headers':headers}
         if proxy:
             get_vars.update({'proxy':proxy})
 
-        async with aiohttp.ClientSession() as client_session:
-            # retry_client = RetryClient(client_session=client_session)
-            async with client_session.get(**get_vars) as resp:
-                html = await resp.text()
-                # save to cache
-                with open(cache_path, 'wb') as stream:
-                    pickle.dump(str(html), stream)
-            # await retry_client.close()
-            return str(html), False
+        async def download():
+            async with AsyncExitStack() as stack:
+                if limits:
+                    with metrics.timer("throttle", name):
+                        for limit in limits:
+                            await stack.enter_async_context(limit)
+                metrics.count("downloads", engine=name)
+                with metrics.timer("download", name):
+                    if session is None:
+                        async with aiohttp.ClientSession() as client_session:
+                            html, status, resp_headers = await self._fetch(
+                                client_session, get_vars, retry_statuses, max_bytes, content_types)
+                    else:
+                        html, status, resp_headers = await self._fetch(
+                            session, get_vars, retry_statuses, max_bytes, content_types)
+
+            # save to cache
+            self.store.set(engine, url, html, status=status, headers=resp_headers)
+            return html
+
+        html, shared = await self._single_flight((engine, url), download)
+        if shared:
+            # this caller made no request, but the source was not read from the cache
+            metrics.count("shared_downloads", engine=name)
+        return html, False
+
+    async def _single_flight(self, key, download):
+        """
+        Runs `download` once for the concurrent callers with the same key: the
+        first one starts it, the others await the same task. The download is
+        cancelled only when every caller awaiting it is.
 
+        :return: the result of the download, and whether it was started by another caller
+        :rtype: (object, bool)
+        """
+        loop = asyncio.get_running_loop()
+        flight = self._in_flight.get(key)
+        shared = flight is not None and flight.task.get_loop() is loop
+        if not shared:
+            flight = _Flight(loop.create_task(download()))
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda _: self._in_flight.get(key) is flight
+                                          and self._in_flight.pop(key))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    async def _fetch(self, session, get_vars, retry_statuses=(), max_bytes=None, content_types=None):
+        async with session.get(**get_vars) as resp:
+            if resp.status in retry_statuses:
+                raise HTTPStatusError(get_vars['url'], resp.status,
+                                      parse_retry_after(resp.headers.get('Retry-After')))
+            # responses without a Content-Type are given the benefit of the doubt
+            if content_types and 'Content-Type' in resp.headers \
+                    and resp.content_type not in content_types:
+                raise ContentRejected(get_vars['url'], resp.content_type)
+            if max_bytes is None:
+                html = str(await resp.text())
+                # the body read by `text`
+                metrics.count("bytes", len(await resp.read()))
+                return html, resp.status, dict(resp.headers)
+
+            body = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                body += chunk
+                if len(body) >= max_bytes:
+                    break
+            body = bytes(body[:max_bytes])
+            metrics.count("bytes", len(body))
+            # a multi-byte character may be cut at the end of the budget
+            try:
+                html = body.decode(resp.charset or 'utf-8', errors='replace')
+            except LookupError:
+                html = body.decode('utf-8', errors='replace')
+            return html, resp.status, dict(resp.headers)
 
     def clear(self, engine=None):
         """
         Clear the entire cache either by engine name
-        or just all
+        or just all. The source codes, search results and parses of an engine
+        are cleared with it; the results cached under the bare query by
+        earlier versions are shared by the engines and only cleared with all.
 
         :param engine: engine to clear
         """
         if not engine:
-            for engine_cache in self.engine_cache.values():
-                for root, dirs, files in os.walk(engine_cache):
-                    for f in files:
-                        os.remove(os.path.join(engine_cache, f))
+            self.store.clear()
         else:
-            engine_cache = self.engine_cache[engine.lower()]
-            for _, _, files in os.walk(engine_cache):
-                for f in files:
-                    os.remove(os.path.join(engine_cache, f))
+            self.store.clear([engine.lower(), namespace("pages", engine), namespace("parses", engine)])
+
+
+def namespace(kind, engine=None):
+    """ Cache namespace of the search results ("pages") or parses ("parses") of an engine """
+    return kind if engine is None else "{}-{}".format(engine.lower(), kind)
+
+
+class _Flight:
+    """ A download in progress and the number of callers awaiting it """
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+def get_event_loop():
+    """
+    Returns the event loop the synchronous API runs searches on: the current
+    one, or a new one when there is none, e.g after `asyncio.run`
+    """
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop
+
+
+_cache_handler = None
+
+
+def get_cache_handler():
+    """ Returns the cache handler shared by every engine, created on first use """
+    global _cache_handler
+    if _cache_handler is None:
+        _cache_handler = CacheHandler()
+    return _cache_handler
+
+
+def set_cache_handler(cache_handler):
+    """
+    Replaces the cache handler shared by every engine, e.g to give each worker
+    process its own cache directory. None resets to the default handler.
+    """
+    global _cache_handler
+    _cache_handler = cache_handler
+
+
+def class_strainer(names, *classes):
+    """
+    SoupStrainer keeping the `names` tags having one of `classes`, with their
+    content, to parse only the result containers of a SERP.
+
+    Tags are matched on each of their classes: a strainer sees the raw class
+    attribute while parsing, where `find_all(class_=...)` sees the split one.
+
+    :param names: tag name(s)
+    :type names: str or list[str]
+    :param classes: classes of the tags to keep
+    :type classes: str
+    """
+    wanted = set(classes)
+
+    def match(value):
+        if not value:
+            return False
+        values = value.split() if isinstance(value, str) else value
+        return not wanted.isdisjoint(values)
+
+    return SoupStrainer(names, class_=match)
 
 
 def tag_visible(element):
@@ -129,27 +395,100 @@ def text_from_soup(soup):
     # return soup.body.get_text(' ', strip=True)
 
     # wiki:
-    text = ""
-    for paragraph in soup.find_all('p'):
-        text += paragraph.text + "\n"
-
-    return text
+    return "".join(paragraph.text + "\n" for paragraph in soup.find_all('p'))
+
+
+# strings BeautifulSoup leaves out of `Tag.text`, and tags keeping their whitespace
+SKIPPED_TEXT_TAGS = ("script", "style", "template", "rt", "rp")
+PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+ASCII_SPACES = frozenset(" \n\t\x0c\r")
+
+
+def _paragraph_strings(element, parts, preserve):
+    """ Appends the strings of an element as BeautifulSoup would see them """
+    preserve = preserve or element.tag in PRESERVE_WHITESPACE_TAGS
+    if element.text:
+        _append_string(parts, element.text, preserve)
+    for child in element:
+        # comments and processing instructions have no str tag
+        if isinstance(child.tag, str) and child.tag not in SKIPPED_TEXT_TAGS:
+            _paragraph_strings(child, parts, preserve)
+        if child.tail:
+            _append_string(parts, child.tail, preserve)
+
+
+def _append_string(parts, string, preserve):
+    # BeautifulSoup collapses strings made of ASCII spaces only
+    if not preserve and ASCII_SPACES.issuperset(string):
+        string = "\n" if "\n" in string else " "
+    parts.append(string)
+
+
+def _text_from_soup_of(html):
+    soup = BeautifulSoup(html, 'lxml')
+    return text_from_soup(soup) if soup.body else None
+
+
+def text_from_html(html):
+    """
+    Same text as `text_from_soup(BeautifulSoup(html, 'lxml'))`, read from an
+    lxml tree instead of a BeautifulSoup one. None when the page has no body.
+
+    :param html: source code of the page
+    :type html: str
+    :rtype: str
+    """
+    lower = html.lower()
+    html_end = lower.find("</html")
+    # libxml2 drops what follows </html> when it builds a tree, BeautifulSoup
+    # does not: such pages go through BeautifulSoup if it matters
+    if html_end != -1 and lower.find("<p", html_end) != -1:
+        return _text_from_soup_of(html)
+
+    try:
+        root = etree.HTML(html, etree.HTMLParser())
+    except ValueError:
+        # str with an XML encoding declaration
+        root = etree.HTML(html.encode("utf-8"), etree.HTMLParser(encoding="utf-8"))
+    if root is None or next(root.iter("body"), None) is None:
+        return _text_from_soup_of(html) if html_end != -1 else None
+
+    parts = []
+    for paragraph in root.iter("p"):
+        ancestors = [ancestor.tag for ancestor in paragraph.iterancestors()]
+        if not any(tag in SKIPPED_TEXT_TAGS for tag in ancestors):
+            preserve = any(tag in PRESERVE_WHITESPACE_TAGS for tag in ancestors)
+            _paragraph_strings(paragraph, parts, preserve)
+        parts.append("\n")
+    return "".join(parts)
+
+
+# citation marks such as [1]
+CITATION_RE = re.compile(r'\[[0-9]*\]')
 
 
 def post_processing(text):
+    """
+    Strips the text, replaces citation marks such as [1] with a space and
+    collapses every run of whitespace into a single space
+    """
     text = text.strip()
 
     # clean [1]...
-    text = re.sub(r'\[[0-9]*\]',' ',text)
-
-    # clean multiple space
-    text = re.sub(r'\s+',' ',text)
-
-    # replace newline
-    for sp in ["\n", "\r", "\t"]:
-        text = text.replace(sp, "\n")
-
-    return text
+    if '[' in text:
+        text = CITATION_RE.sub(' ', text)
+
+    # clean multiple space, same as re.sub(r'\s+', ' ', text): str.split
+    # drops the whitespace at both ends, which a citation may have left
+    words = text.split()
+    if not words:
+        return ' ' if text else ''
+    result = ' '.join(words)
+    if text[0].isspace():
+        result = ' ' + result
+    if text[-1].isspace():
+        result += ' '
+    return result
 
 
 blocked_sites = [
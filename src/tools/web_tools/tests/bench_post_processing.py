@@ -0,0 +1,62 @@
+"""@desc
+		Micro-benchmark of `utils.post_processing` against the regex pipeline it
+		replaces, on the text of pages (saved .html files, or generated pages)
+
+	usage (from src/tools): python -m web_tools.tests.bench_post_processing [directory of .html files]
+"""
+import os
+import re
+import sys
+import random
+import timeit
+
+from web_tools.core.utils import post_processing, text_from_html
+
+
+def reference_post_processing(text):
+    """ `post_processing` as it was: two uncompiled substitutions and a replace loop """
+    text = text.strip()
+    text = re.sub(r'\[[0-9]*\]', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    for sp in ["\n", "\r", "\t"]:
+        text = text.replace(sp, "\n")
+    return text
+
+
+def generated_pages(count=200, seed=0):
+    rnd = random.Random(seed)
+    words = ["search", "engine", "result", "page", "the", "of", "données", "model,", "value.", "\t"]
+    for _ in range(count):
+        paragraphs = []
+        for _ in range(rnd.randint(1, 60)):
+            paragraph = " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 120)))
+            if rnd.random() < 0.3:
+                paragraph += "<sup>[{}]</sup>".format(rnd.randint(1, 40))
+            paragraphs.append("<p>{}</p>\n  ".format(paragraph))
+        yield "<html><body>{}</body></html>".format("".join(paragraphs))
+
+
+def load_pages(directory):
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                yield f.read()
+
+
+def main(directory=None):
+    pages = load_pages(directory) if directory else generated_pages()
+    texts = [text for text in map(text_from_html, pages) if text is not None]
+    # match strings are post-processed too
+    texts += [reference_post_processing(text)[:500] for text in texts]
+
+    for text in texts:
+        assert post_processing(text) == reference_post_processing(text)
+    print("{} texts, {} chars, same output".format(len(texts), sum(map(len, texts))))
+
+    for func in (reference_post_processing, post_processing):
+        seconds = min(timeit.repeat(lambda: [func(text) for text in texts], number=1, repeat=5))
+        print("{}: {:.2f} ms".format(func.__name__, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,155 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from web_tools.core import cache
+from web_tools.core.cache import FileCacheStore, SQLiteCacheStore, LRUCacheStore, CacheEntry, encode_entry, \
+    hash_key
+
+HTML = "<html><body><p>Hello cache</p></body></html>"
+RESULTS = ({"title": "Hello", "link": "https://example.com", "page": "Hello cache"},)
+
+
+class StoreTestMixin:
+    """ Tests shared by every store """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.store = self.create_store()
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.store.get("google", "https://example.com"))
+        self.store.set("google", "https://example.com", HTML, status=200, headers={"Content-Type": "text/html"})
+        self.store.set("pages", "hello", RESULTS)
+        entry = self.store.get("google", "https://example.com")
+        self.assertEqual(entry.value, HTML)
+        self.assertIsNotNone(entry.fetched_at)
+        self.assertEqual(list(self.store.get("pages", "hello").value), list(RESULTS))
+
+    def test_clear(self):
+        self.store.set("google", "a", HTML)
+        self.store.set("bing", "a", HTML)
+        self.store.clear(["google"])
+        self.assertIsNone(self.store.get("google", "a"))
+        self.assertIsNotNone(self.store.get("bing", "a"))
+        self.store.clear()
+        self.assertIsNone(self.store.get("bing", "a"))
+
+
+class FileCacheStoreTests(StoreTestMixin, unittest.TestCase):
+
+    def create_store(self):
+        return FileCacheStore(self.tmpdir.name)
+
+    def write_pickle(self, namespace, key, value):
+        path = os.path.join(self.store.namespace_path(namespace), hash_key(key))
+        with open(path, 'wb') as stream:
+            pickle.dump(value, stream)
+        return path
+
+    def test_reads_pickle_files(self):
+        self.write_pickle("google", "https://example.com", HTML)
+        self.assertEqual(self.store.get("google", "https://example.com").value, HTML)
+
+    def test_migrate(self):
+        path = self.write_pickle("google", "https://example.com", HTML)
+        self.write_pickle("pages", "hello", RESULTS)
+        self.assertEqual(self.store.migrate(), {"google": 1, "pages": 1})
+        self.assertEqual(self.store.migrate(), {"google": 0, "pages": 0})
+        with open(path, 'rb') as stream:
+            self.assertTrue(stream.read().startswith(cache.MAGIC))
+        self.assertEqual(self.store.get("google", "https://example.com").value, HTML)
+        self.assertEqual(self.store.get("pages", "hello").value, list(RESULTS))
+
+    def test_writes_are_atomic(self):
+        self.store.set("google", "a", HTML)
+        with patch.object(cache.os, "replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.store.set("google", "a", "<html>new</html>")
+        # the previous entry is left whole, without temporary files
+        self.assertEqual(self.store.get("google", "a").value, HTML)
+        self.assertEqual(os.listdir(self.store.namespace_path("google")), [hash_key("a")])
+
+    def test_truncated_pickle_is_a_miss(self):
+        path = self.write_pickle("google", "a", HTML)
+        with open(path, 'r+b') as stream:
+            stream.truncate(10)
+        self.assertIsNone(self.store.get("google", "a"))
+
+    def test_header_without_body(self):
+        self.store.set("google", "a", HTML, status=200)
+        codec, kind, status, _ = self.store.get_header("google", "a")
+        self.assertEqual((codec, kind, status), (self.store.codec, "text", 200))
+
+
+class LRUCacheStoreTests(StoreTestMixin, unittest.TestCase):
+
+    def create_store(self):
+        return LRUCacheStore(FileCacheStore(self.tmpdir.name), max_bytes=100)
+
+    def test_hits_are_served_from_memory(self):
+        self.store.set("google", "a", "x" * 10)
+        with patch.object(self.store.store, 'get') as disk_get:
+            self.assertEqual(self.store.get("google", "a").value, "x" * 10)
+        disk_get.assert_not_called()
+        self.assertIsNone(self.store.get("google", "b"))
+        self.assertEqual(self.store.stats(), {"hits": 1, "misses": 1, "entries": 1, "bytes": 10})
+
+    def test_evicts_least_recently_used(self):
+        for key in "abc":
+            self.store.set("google", key, "x" * 40)
+        self.store.get("google", "a")
+        self.store.set("google", "d", "x" * 40)
+        self.assertEqual([k for _, k in self.store._entries], ["a", "d"])
+        self.assertEqual(self.store.size, 80)
+        # evicted entries are still on disk
+        self.assertEqual(self.store.get("google", "b").value, "x" * 40)
+
+    def test_ttl(self):
+        store = LRUCacheStore(FileCacheStore(self.tmpdir.name), ttl=10)
+        store.set("google", "a", HTML)
+        with patch('time.monotonic', return_value=cache.time.monotonic() + 20):
+            store.get("google", "a")
+        self.assertEqual(store.stats()["misses"], 1)
+
+
+class CodecTests(unittest.TestCase):
+
+    def test_codecs_roundtrip(self):
+        for codec in ("none", "zlib", "zstd"):
+            if codec == "zstd" and cache.zstandard is None:
+                continue
+            data = encode_entry(HTML * 10, status=200, fetched_at=1.0, codec=codec)
+            entry = CacheEntry.decode(data)
+            self.assertEqual((entry.value, entry.status, entry.fetched_at), (HTML * 10, 200, 1.0))
+            if codec != "none":
+                self.assertLess(len(data), len(HTML * 10))
+
+    def test_other_formats_are_not_decoded(self):
+        self.assertIsNone(CacheEntry.decode(pickle.dumps(HTML)))
+
+
+class SQLiteCacheStoreTests(StoreTestMixin, unittest.TestCase):
+
+    def create_store(self):
+        store = SQLiteCacheStore(os.path.join(self.tmpdir.name, "cache.db"))
+        self.addCleanup(store.close)
+        return store
+
+    def test_headers_and_status(self):
+        self.store.set("google", "a", HTML, status=200, headers={"Content-Type": "text/html"})
+        entry = self.store.get("google", "a")
+        self.assertEqual(entry.status, 200)
+        self.assertEqual(entry.headers, {"Content-Type": "text/html"})
+
+    def test_import_file_cache(self):
+        root = os.path.join(self.tmpdir.name, "files")
+        files = FileCacheStore(root)
+        files.set("google", "https://example.com", HTML)
+        files.set("pages", "hello", RESULTS)
+        self.assertEqual(self.store.import_file_cache(root), {"google": 1, "pages": 1})
+        self.assertEqual(self.store.get("google", "https://example.com").value, HTML)
+        self.assertEqual(self.store.get("pages", "hello").value, list(RESULTS))
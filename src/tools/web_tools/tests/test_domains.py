@@ -0,0 +1,125 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch, AsyncMock
+from urllib.parse import urlparse
+
+from web_tools.core import utils
+from web_tools.core.domains import DomainScheduler, HedgePolicy
+from web_tools.core.engines.google import Search as GoogleSearch
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DomainSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = DomainScheduler(("a", "b", "c"), cooldown=10, max_cooldown=25, clock=self.clock)
+
+    def test_failing_domain_cools_down(self):
+        self.scheduler.report("a", False)
+        self.assertNotIn("a", {self.scheduler.choose() for _ in range(50)})
+        # tried once when the cooldown is over
+        self.clock.now = 10
+        self.assertEqual(self.scheduler.choose(), "a")
+
+    def test_cooldown_doubles_up_to_max(self):
+        for expected in (10, 20, 25):
+            self.scheduler.report("a", False)
+            self.assertEqual(self.scheduler.stats()["a"]["cooldown"], expected)
+        self.scheduler.report("a", True)
+        self.assertEqual(self.scheduler.stats()["a"]["cooldown"], 0)
+
+    def test_prefers_fast_healthy_domains(self):
+        self.scheduler.report("a", True, latency=0.2)
+        self.scheduler.report("b", True, latency=3.0)
+        self.scheduler.report("c", True, latency=3.0)
+        chosen = [self.scheduler.choose() for _ in range(300)]
+        # "a" wins every draw it is part of: 2 draws out of 3
+        self.assertGreater(chosen.count("a"), 150)
+
+    def test_all_cooling_down(self):
+        self.scheduler.report("a", False)
+        self.scheduler.report("b", False)
+        self.scheduler.report("b", False)
+        self.clock.now = 1
+        self.scheduler.report("c", False)
+        self.assertEqual(self.scheduler.choose(), "a")
+
+    def test_exclude(self):
+        self.assertNotIn("a", {self.scheduler.choose(exclude=("a",)) for _ in range(50)})
+        self.assertEqual(DomainScheduler(("a",)).choose(exclude=("a",)), "a")
+
+    def test_search_reports_engine_failure(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        engine = GoogleSearch(cache_handler=utils.CacheHandler(cache_dir=tmpdir.name))
+        scheduler = DomainScheduler(engine.domain_list, clock=self.clock)
+        failure = [{"title": None, "page": None}]
+        with patch.object(GoogleSearch, 'domain_scheduler', scheduler), \
+                patch.object(engine, 'get_source', AsyncMock(return_value="<html></html>")) as get_source, \
+                patch.object(engine, 'aget_source_results', AsyncMock(return_value=failure)):
+            asyncio.run(engine.asearch("hello", retry=0, page_cache=False))
+        domain = urlparse(get_source.await_args.args[0]).netloc
+        self.assertEqual(scheduler.stats()[domain]["failures"], 1)
+        self.assertGreater(scheduler.stats()[domain]["cooldown"], 0)
+
+
+class HedgingTests(unittest.TestCase):
+
+    def test_policy_quantile_and_budget(self):
+        policy = HedgePolicy(quantile=0.9, budget=0.5, burst=1, min_samples=10)
+        for latency in range(1, 10):
+            policy.record(latency / 10)
+        self.assertIsNone(policy.delay())
+        policy.record(1.0)
+        self.assertEqual(policy.delay(), 1.0)
+        # one hedge per two searches, not saved up beyond `burst`
+        self.assertEqual([policy.spend(), policy.spend()], [True, False])
+        policy.record()
+        self.assertFalse(policy.spend())
+        policy.record()
+        self.assertTrue(policy.spend())
+
+    def test_slow_search_is_hedged(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        engine = GoogleSearch(cache_handler=utils.CacheHandler(cache_dir=tmpdir.name))
+        engine.domain_list = ("slow.example", "fast.example")
+        engine.hedging = True
+        scheduler = DomainScheduler(engine.domain_list)
+        policy = HedgePolicy(min_samples=1, budget=1)
+        policy.record(0.01)
+        cancelled = []
+
+        async def get_source(url, cache=True, **kwargs):
+            engine._cache_hit = False
+            if "slow" in url:
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(url)
+                    raise
+            return "<html>{}</html>".format(urlparse(url).netloc)
+
+        with patch.object(GoogleSearch, 'domain_scheduler', scheduler), \
+                patch.object(GoogleSearch, 'hedge_policy', policy), \
+                patch.object(engine, 'get_source', get_source):
+            html, cache_hit, url, _ = asyncio.run(engine.get_serp_source("https://slow.example/search?q=a"))
+        self.assertEqual((html, cache_hit, url), ("<html>fast.example</html>", False,
+                                                  "https://fast.example/search?q=a"))
+        self.assertEqual(cancelled, ["https://slow.example/search?q=a"])
+        self.assertEqual(policy.hedges, 1)
+        self.assertGreater(scheduler.stats()["slow.example"]["latency"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import random
+import string
+import unittest
+
+from fuzzysearch import find_near_matches
+from fuzzysearch.levenshtein_ngram import _py_expand_long, _py_expand_short
+
+from web_tools.core.matching import NearMatcher, BoundaryIndex, expand, expand_short
+from web_tools.core.engines.google import Search as GoogleSearch
+
+
+def mutate(rnd, text, edits):
+    chars = list(text)
+    for _ in range(edits):
+        i = rnd.randrange(len(chars))
+        op = rnd.random()
+        if op < 0.4:
+            chars[i] = rnd.choice(string.ascii_lowercase + " .")
+        elif op < 0.7:
+            del chars[i]
+        else:
+            chars.insert(i, rnd.choice(string.ascii_lowercase))
+    return "".join(chars)
+
+
+def make_page(rnd):
+    words = ["".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 9)))
+             for _ in range(rnd.choice([20, 300]))] + ["the", "of", "and", "a", "to", "in"] * 30
+    text = " ".join(rnd.choice(words) for _ in range(rnd.choice([100, 1500])))
+    # repeated segments give several candidate windows
+    start = rnd.randrange(max(1, len(text) - 200))
+    segment = text[start:start + 200]
+    text = text[:len(text) // 2] + segment + text[len(text) // 2:]
+
+    parts = []
+    for _ in range(4):
+        start = rnd.randrange(max(1, len(text) - 160))
+        part = text[start:start + rnd.randint(26, 160)]
+        parts.append(mutate(rnd, part, rnd.randint(0, len(part) // 8)))
+    # unrelated snippet
+    parts.append(" ".join(rnd.choice(words) for _ in range(12)))
+    return text, [p for p in parts if len(p) > 25]
+
+
+class NearMatcherTests(unittest.TestCase):
+
+    def test_expand_matches_fuzzysearch(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            sub = "".join(rnd.choice("abc ") for _ in range(rnd.randint(11, 60)))
+            max_l_dist = rnd.randint(0, 5)
+            seq = mutate(rnd, sub, rnd.randint(0, 8)) + "".join(rnd.choice("abc ") for _ in range(5))
+            self.assertEqual(expand(sub, seq, max_l_dist), _py_expand_long(sub, seq, max_l_dist))
+
+    def test_expand_short_matches_fuzzysearch(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            sub = "".join(rnd.choice("abc ") for _ in range(rnd.randint(4, 10)))
+            max_l_dist = rnd.randint(0, 5)
+            seq = mutate(rnd, sub, rnd.randint(0, 3)) + "".join(rnd.choice("abc ") for _ in range(5))
+            self.assertEqual(expand_short(sub, seq, max_l_dist), _py_expand_short(sub, seq, max_l_dist))
+
+    def test_same_first_match_as_find_near_matches(self):
+        rnd = random.Random(0)
+        for _ in range(60):
+            text, parts = make_page(rnd)
+            matcher = NearMatcher(text)
+            for part in parts:
+                max_l_dist = int(0.1 * len(part))
+                matches = find_near_matches(part, text, max_l_dist=max_l_dist)
+                expected = matches[0] if matches else None
+                self.assertEqual(matcher.find_first(part, max_l_dist), expected)
+
+    def test_no_match(self):
+        matcher = NearMatcher("the quick brown fox jumps over the lazy dog")
+        self.assertIsNone(matcher.find_first("completely unrelated sentence here", 3))
+
+
+class BoundaryIndexTests(unittest.TestCase):
+
+    def test_expand_to_stops(self):
+        text = "First one. Second sentence here\nThird}"
+        boundaries = BoundaryIndex(text)
+        start = text.index("sentence")
+        self.assertEqual(boundaries.expand(start, start + 8), (10, text.index("\n") + 1))
+        self.assertEqual(boundaries.expand(0, 5), (0, 10))
+        # a match ending on a stop keeps it
+        self.assertEqual(boundaries.expand(2, 10), (0, 10))
+        self.assertEqual(BoundaryIndex("no stops").expand(3, 5), (0, 5))
+
+    def test_spans_do_not_drift(self):
+        text = "Alpha beta gamma delta epsilon. Zeta eta theta iota kappa lambda. Mu nu xi omicron pi rho sigma."
+        parts = ["Zeta eta theta iota kappa lambda", "Mu nu xi omicron pi rho sigma"]
+        spans = GoogleSearch.__new__(GoogleSearch).get_match_spans(text, parts)
+        self.assertEqual([text[start:end] for start, end in spans], [" " + p + "." for p in parts])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch, AsyncMock
+from urllib.parse import urlparse
+
+from web_tools.core import utils
+from web_tools.core.base import BaseSearch
+from web_tools.core.metasearch import asearch_first, asearch_merged, link_key
+from web_tools.core.engines.bing import Search as BingSearch
+
+BING_SERP = """<html><body><ol>
+<li class="b_algo"><h2><a href="https://example.com/1">Result 1</a></h2>
+<div class="b_caption"><p>Description of result 1</p></div></li>
+</ol></body></html>"""
+BING_RESULT = {"title": "Result 1", "link": "https://example.com/1", "description": "Description of result 1"}
+
+
+class FakeEngine:
+    """ Engine fetching pages, with a canned result """
+
+    fetches_pages = True
+    is_found = BaseSearch.is_found
+
+    def __init__(self, name, result, delay=0.0):
+        self.name = name
+        self.result = result
+        self.delay = delay
+        self.cancelled = False
+
+    async def asearch(self, query, **kwargs):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def result(link, page="Some page"):
+    return {"title": "Title", "link": link, "page": page}
+
+
+class SearchFirstTests(unittest.TestCase):
+
+    def test_fastest_good_result_wins(self):
+        slow = FakeEngine("Google", result("https://a.com"), delay=5)
+        empty = FakeEngine("Bing", {"page": "No evidence found, please change query."})
+        failing = FakeEngine("Ask", RuntimeError("blocked"))
+        fast = FakeEngine("Baidu", result("https://b.com"), delay=0.01)
+        found = asyncio.run(asearch_first([slow, empty, failing, fast], "query"))
+        self.assertEqual(found, dict(result("https://b.com"), engine="Baidu"))
+        self.assertTrue(slow.cancelled)
+
+    def test_no_good_result(self):
+        engines = [FakeEngine("Google", RuntimeError("blocked")),
+                   FakeEngine("Bing", {"page": ""})]
+        self.assertEqual(asyncio.run(asearch_first(engines, "query")), {"page": "", "engine": "Bing"})
+        with self.assertRaises(RuntimeError):
+            asyncio.run(asearch_first(engines[:1], "query"))
+
+
+class SearchMergedTests(unittest.TestCase):
+
+    def test_dedupe_by_link(self):
+        engines = [FakeEngine("Google", result("https://www.a.com/x/")),
+                   FakeEngine("Bing", result("http://a.com/x#top", page="Other page")),
+                   FakeEngine("Ask", RuntimeError("blocked")),
+                   FakeEngine("Baidu", result("https://b.com"))]
+        merged = asyncio.run(asearch_merged(engines, "query", return_exceptions=True))
+        self.assertEqual([(r["engine"], r["link"]) for r in merged],
+                         [("Google", "https://www.a.com/x/"), ("Baidu", "https://b.com")])
+        self.assertEqual(link_key("https://a.com/?q=1"), "a.com?q=1")
+
+
+
+class EnginesWithoutPagesTests(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.bing = BingSearch(cache_handler=utils.CacheHandler(cache_dir=tmpdir.name))
+        self.bing.attach_metrics = False
+        self.assertFalse(self.bing.fetches_pages)
+
+    def search(self, search, engines, **kwargs):
+        with patch.object(self.bing, 'get_source', AsyncMock(return_value=BING_SERP)) as get_source:
+            found = asyncio.run(search(engines, "hello", **kwargs))
+        return found, get_source
+
+    def test_bing_search(self):
+        with patch.object(self.bing, 'get_source', AsyncMock(return_value=BING_SERP)) as get_source:
+            result = asyncio.run(self.bing.asearch("hello", retry=1))
+            # served from the page cache
+            self.assertEqual(asyncio.run(self.bing.asearch("hello")), result)
+        self.assertEqual(result, BING_RESULT)
+        # searched on Bing, once
+        self.assertEqual(get_source.await_count, 1)
+        self.assertEqual(urlparse(get_source.await_args[0][0]).netloc, "www.bing.com")
+
+    def test_falls_back_to_bing(self):
+        blocked = FakeEngine("Google", RuntimeError("blocked"))
+        slow = FakeEngine("Google", result("https://a.com"), delay=5)
+        found, _ = self.search(asearch_first, [blocked, self.bing])
+        self.assertEqual(found, dict(BING_RESULT, engine="Bing"))
+        found, _ = self.search(asearch_first, [slow, self.bing])
+        self.assertEqual(found, dict(BING_RESULT, engine="Bing"))
+        self.assertTrue(slow.cancelled)
+
+    def test_page_wins_over_bing(self):
+        google = FakeEngine("Google", result("https://a.com"))
+        found, _ = self.search(asearch_first, [google, self.bing])
+        self.assertEqual(found["engine"], "Google")
+
+    def test_merged_with_bing(self):
+        engines = [FakeEngine("Google", result("https://www.example.com/1")),
+                   FakeEngine("Google", {"title": None, "page": None}), self.bing]
+        merged, _ = self.search(asearch_merged, engines)
+        self.assertEqual(merged, [dict(result("https://www.example.com/1"), engine="Google")])
+        engines[0].result = result("https://b.com")
+        merged, _ = self.search(asearch_merged, engines)
+        self.assertEqual([(r["engine"], r["link"]) for r in merged],
+                         [("Google", "https://b.com"), ("Bing", "https://example.com/1")])
+
+
+if __name__ == '__main__':
+    unittest.main()
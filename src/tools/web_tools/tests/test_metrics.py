@@ -0,0 +1,98 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch, AsyncMock
+
+from web_tools.core import utils
+# the metrics module the engines use
+from web_tools.core.base import metrics
+from web_tools.core.engines.bing import Search as BingSearch
+from web_tools.tests.test_search import BING_SERP
+
+
+class MetricsRegistryTests(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1.0))
+        registry.observe("Google", "fetch", 0.05)
+        registry.observe("Google", "fetch", 0.5)
+        registry.incr("Google", "cache_hits", 2)
+        registry.incr('Bing"', "cache_hits")
+        self.assertEqual(registry.to_prometheus().splitlines()[2:], [
+            'web_tools_stage_seconds_bucket{engine="Google",stage="fetch",le="0.1"} 1',
+            'web_tools_stage_seconds_bucket{engine="Google",stage="fetch",le="1.0"} 2',
+            'web_tools_stage_seconds_bucket{engine="Google",stage="fetch",le="+Inf"} 2',
+            'web_tools_stage_seconds_sum{engine="Google",stage="fetch"} 0.55',
+            'web_tools_stage_seconds_count{engine="Google",stage="fetch"} 2',
+            '# TYPE web_tools_cache_hits_total counter',
+            'web_tools_cache_hits_total{engine="Bing\\""} 1',
+            'web_tools_cache_hits_total{engine="Google"} 2',
+        ])
+        self.assertEqual(registry.snapshot()["Google"]["counters"], {"cache_hits": 2})
+        registry.reset()
+        self.assertEqual(registry.to_prometheus(), "")
+
+    def test_collect_follows_tasks(self):
+        async def search():
+            with metrics.collect("Google") as search_metrics:
+                async def page():
+                    with metrics.timer("page_fetch"):
+                        metrics.count("downloads")
+                await asyncio.gather(page(), page())
+            metrics.count("outside")
+            return search_metrics
+
+        self.addCleanup(metrics.set_registry, None)
+        metrics.set_registry(metrics.MetricsRegistry())
+        search_metrics = asyncio.run(search())
+        self.assertEqual(search_metrics.counters, {"downloads": 2})
+        self.assertEqual(list(search_metrics.stages), ["page_fetch"])
+        self.assertEqual(metrics.get_registry().snapshot()["unknown"]["counters"], {"outside": 1})
+
+
+class SearchMetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.engine = BingSearch(cache_handler=utils.CacheHandler(cache_dir=self.tmpdir.name))
+        self.addCleanup(metrics.set_registry, None)
+        metrics.set_registry(metrics.MetricsRegistry())
+
+    def test_result_carries_its_metrics(self):
+        url = self.engine.get_search_url("hello", 1)
+        self.engine.cache_handler.store.set("bing", url, BING_SERP)
+        async def complete(entries, num_pages):
+            return [dict(entry, page="Page of " + entry["title"]) for entry in entries]
+
+        with patch.object(self.engine, 'get_search_url', return_value=url), \
+                patch.object(self.engine, 'acomplete_entries', complete):
+            result = asyncio.run(self.engine.asearch("hello", page_cache=False))
+        self.assertEqual(result["link"], "https://example.com/1")
+        search_metrics = result["metrics"]
+        self.assertEqual(search_metrics["counters"], {"searches": 1, "cache_hits": 1})
+        self.assertEqual(set(search_metrics["stages"]), {"search", "url", "serp_fetch", "cache", "serp_parse"})
+        snapshot = metrics.get_registry().snapshot()
+        self.assertEqual(snapshot["Bing"]["stages"]["search"]["count"], 1)
+
+    def test_retries_are_part_of_the_search(self):
+        failure = [{"title": None, "page": None}]
+        with patch.object(self.engine, 'get_source', AsyncMock(return_value=None)), \
+                patch.object(self.engine, 'aget_source_results', AsyncMock(return_value=failure)):
+            result = asyncio.run(self.engine.asearch("hello", retry=2, page_cache=False))
+        self.assertEqual(result["metrics"]["counters"], {"searches": 1, "search_retries": 2})
+        self.assertEqual(metrics.get_registry().snapshot()["Bing"]["stages"]["serp_fetch"]["count"], 3)
+
+    def test_cache_labelled_with_engine_name(self):
+        cache_handler = self.engine.cache_handler
+        cache_handler.store.set("bing", "https://www.bing.com/search?q=a", BING_SERP)
+        # outside of a search, as e.g for the pages of the results
+        html, cache_hit = asyncio.run(cache_handler.get_source("Bing", "https://www.bing.com/search?q=a", {}))
+        self.assertEqual((html, cache_hit), (BING_SERP, True))
+        snapshot = metrics.get_registry().snapshot()
+        self.assertEqual(snapshot["Bing"]["counters"], {"cache_hits": 1})
+        self.assertNotIn("bing", snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import os
+import asyncio
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from web_tools.core import base, ratelimit, utils
+from web_tools.core.ratelimit import TokenBucket, SharedTokenBucket, ConcurrencyLimit
+from web_tools.core.engines.google import Search as GoogleSearch
+from web_tools.core.engines.googlescholar import Search as ScholarSearch
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0])
+        # waits are queued one after the other
+        self.assertEqual([bucket.reserve() for _ in range(2)], [0.5, 1.0])
+        clock.now = 10
+        self.assertEqual(bucket.reserve(), 0)
+
+    def test_refund(self):
+        bucket = TokenBucket(rate=1, burst=1, clock=FakeClock())
+        bucket.reserve()
+        self.assertEqual(bucket.reserve(), 1.0)
+        bucket.refund()
+        self.assertEqual(bucket.reserve(), 1.0)
+
+
+class SharedTokenBucketTests(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "limits.db")
+        self.clock = FakeClock()
+
+    def bucket(self, name="engine:Google"):
+        bucket = SharedTokenBucket(self.path, name, rate=2, burst=2, clock=self.clock)
+        self.addCleanup(bucket.close)
+        return bucket
+
+    def test_budget_is_shared(self):
+        # one connection per process
+        first, second = self.bucket(), self.bucket()
+        self.assertEqual([first.reserve(), second.reserve()], [0, 0])
+        self.assertEqual([second.reserve(), first.reserve()], [0.5, 1.0])
+        first.refund()
+        self.clock.now = 10
+        self.assertEqual(second.reserve(), 0)
+        # other names have their own budget
+        self.assertEqual(self.bucket("engine:Bing").reserve(), 0)
+
+    def test_acquire_runs_off_the_loop(self):
+        bucket = self.bucket()
+        threads = []
+        update = bucket._update
+
+        def record_thread(taken):
+            threads.append(threading.get_ident())
+            return update(taken)
+
+        async def run():
+            with patch.object(bucket, '_update', side_effect=record_thread):
+                await bucket.acquire()
+                # the second token is taken, the third is refunded when cancelled
+                await bucket.acquire()
+                task = asyncio.ensure_future(bucket.acquire())
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        asyncio.run(run())
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_get_limit_uses_shared_path(self):
+        ratelimit.set_shared_path(self.path)
+        self.addCleanup(ratelimit.set_shared_path, None)
+        limit = ratelimit.get_limit(("engine", "shared"), 1, 1)
+        bucket = limit.bucket
+        self.addCleanup(bucket.close)
+        self.assertIsInstance(bucket, SharedTokenBucket)
+        self.assertEqual(bucket.name, "engine:shared")
+        # reconfigured in place
+        self.assertIs(ratelimit.get_limit(("engine", "shared"), 2, 1), limit)
+        self.assertIs(limit.bucket, bucket)
+        self.assertEqual(bucket.rate, 2)
+        ratelimit.set_shared_path(None)
+        self.assertIs(ratelimit.get_limit(("engine", "shared"), 2, 1), limit)
+        self.assertNotIsInstance(limit.bucket, SharedTokenBucket)
+        # the replaced bucket is closed
+        self.assertIsNone(bucket._conn)
+
+
+class ConcurrencyLimitTests(unittest.TestCase):
+
+    def test_caps_concurrent_holders(self):
+        limit = ConcurrencyLimit(2)
+        running = []
+
+        async def task():
+            await limit.acquire()
+            try:
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+            finally:
+                limit.release()
+
+        async def main():
+            await asyncio.gather(*(task() for _ in range(6)))
+
+        peak = []
+        asyncio.run(main())
+        self.assertEqual(len(peak), 6)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(limit._holders, 0)
+
+    def test_cancelled_waiter_gives_up_its_turn(self):
+        limit = ConcurrencyLimit(1)
+
+        async def main():
+            await limit.acquire()
+            waiter = asyncio.ensure_future(limit.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            limit.release()
+
+        asyncio.run(main())
+        self.assertEqual(limit._holders, 0)
+        self.assertFalse(limit._waiters)
+
+
+class LimitRegistryTests(unittest.TestCase):
+
+    def test_shared_until_reconfigured(self):
+        key = ("engine", "test")
+        limit = ratelimit.get_limit(key, 1, 2, 3)
+        self.assertIs(ratelimit.get_limit(key, 1, 2, 3), limit)
+        bucket = limit.bucket
+        self.assertIs(ratelimit.get_limit(key, 2, 2, 4), limit)
+        self.assertEqual(limit.config, (2, 2, 4))
+        self.assertIs(limit.bucket, bucket)
+        self.assertEqual((bucket.rate, limit.concurrency.limit), (2, 4))
+        ratelimit.get_limit(key)
+        self.assertIsNone(limit.bucket)
+
+    def test_reconfigured_with_requests_in_progress(self):
+        key = ("engine", "reconfigured")
+        limit = ratelimit.get_limit(key, max_concurrency=1)
+        order = []
+
+        async def request(name):
+            async with limit:
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            first = asyncio.ensure_future(request("first"))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(request("second"))
+            await asyncio.sleep(0)
+            # the holder of the old configuration still counts
+            ratelimit.get_limit(key, max_concurrency=1)
+            self.assertEqual(order, ["first"])
+            # a higher limit lets the waiter in
+            ratelimit.get_limit(key, max_concurrency=2)
+            for _ in range(3):
+                await asyncio.sleep(0)
+            self.assertEqual(order, ["first", "second"])
+            await asyncio.gather(first, second)
+
+        asyncio.run(main())
+        self.assertEqual(limit.concurrency._holders, 0)
+
+    def test_engine_limit_covers_searches(self):
+        engine = GoogleSearch.__new__(GoogleSearch)
+        url = "https://{}/search?q=hello".format(base.get_domains()[0])
+        self.assertEqual([l.config for l in engine.get_limits(url, serp=True)],
+                         [(engine.rate_limit, engine.rate_burst, engine.max_concurrency)])
+        # the pages of the results
+        self.assertEqual(engine.get_limits(url), [])
+        self.assertEqual(engine.get_limits("https://en.wikipedia.org/wiki/Search"), [])
+
+    def test_scholar_limit_is_acquired(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        engine = ScholarSearch(cache_handler=utils.CacheHandler(cache_dir=tmpdir.name))
+        engine.attach_metrics = False
+        # the ratelimit module the engines use
+        limit_class = base.ratelimit.Limit
+        aenter = limit_class.__aenter__
+        entered = []
+
+        async def record(limit):
+            entered.append(limit.config)
+            return await aenter(limit)
+
+        async def fetch(*args, **kwargs):
+            return "<html></html>", 200, {}
+
+        with patch.object(limit_class, '__aenter__', record), \
+                patch.object(engine.cache_handler, '_fetch', side_effect=fetch):
+            asyncio.run(engine.asearch("hello", retry=0, cache=False, page_cache=False))
+        self.assertEqual(entered, [(engine.rate_limit, engine.rate_burst, engine.max_concurrency)])
+
+
+if __name__ == '__main__':
+    unittest.main()
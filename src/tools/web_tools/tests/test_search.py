@@ -0,0 +1,437 @@
+import gc
+import pickle
+import asyncio
+import tempfile
+import warnings
+import unittest
+from importlib import import_module
+from unittest.mock import patch, AsyncMock
+from urllib.parse import urlparse, parse_qs
+
+from web_tools.core import utils
+# the executor module the engines use
+from web_tools.core.base import executor, asearch_many
+from web_tools.core.engines.bing import Search as BingSearch
+from web_tools.core.engines.google import Search as GoogleSearch
+from web_tools.core.engines.baidu import Search as BaiduSearch
+
+BING_SERP = """<html><body><ol>
+<li class="b_algo"><h2><a href="https://example.com/1">Result 1</a></h2>
+<div class="b_caption"><p>Description of result 1</p></div></li>
+<li class="b_algo"><h2><a href="https://example.com/2">Result 2</a></h2>
+<div class="b_caption"><p>Description of result 2</p></div></li>
+</ol></body></html>"""
+
+BAIDU_SERP = """<html><body>
+<div id="1" class="result c-container"><h3><a href="https://example.com/1">Result 1</a></h3>
+<div class="c-abstract">Description of result 1</div></div>
+</body></html>"""
+
+RESULTS = [{"title": "Result {}".format(i), "link": "https://example.com/{}".format(i),
+            "page": "Page of result {}".format(i)} for i in range(1, 4)]
+
+
+class PageCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache_handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+        self.engine = GoogleSearch(cache_handler=self.cache_handler)
+
+    def search(self, engine, query, **kwargs):
+        with patch.object(engine, 'get_source', AsyncMock(return_value=None)), \
+                patch.object(engine, 'aget_source_results', AsyncMock(return_value=list(RESULTS))) as get_results:
+            result = asyncio.run(engine.asearch(query, **kwargs))
+        # timings and counters of the search, see test_metrics
+        self.assertIn("searches", result.pop("metrics")["counters"])
+        return result, get_results.await_count
+
+    def test_key_includes_engine_end_year_and_params(self):
+        key = self.engine.get_page_cache_key("hello  world", end_year=2022)
+        self.assertEqual(key, self.engine.get_page_cache_key(" hello world ", end_year=2022))
+        self.assertNotEqual(key, self.engine.get_page_cache_key("hello world", end_year=2023))
+        self.assertNotEqual(key, self.engine.get_page_cache_key("hello world", end_year=2022, hl="de"))
+        self.assertEqual(key, self.engine.get_page_cache_key("hello world", end_year=2022, proxy="p"))
+        bing = BingSearch(cache_handler=self.cache_handler)
+        self.assertNotEqual(key, bing.get_page_cache_key("hello world", end_year=2022))
+
+    def test_smaller_topk_served_from_cache(self):
+        result, fetches = self.search(self.engine, "hello", topk=3)
+        self.assertEqual((result, fetches), (RESULTS[2], 1))
+        result, fetches = self.search(self.engine, "hello", topk=2)
+        self.assertEqual((result, fetches), (RESULTS[1], 0))
+
+    def test_clear_engine(self):
+        bing = BingSearch(cache_handler=self.cache_handler)
+        for engine in (self.engine, bing):
+            self.search(engine, "hello", topk=1)
+            key, _ = engine.get_cached_parse("serp", BING_SERP)
+            self.cache_handler.set_parse(key, ["entry"], engine.name)
+        self.cache_handler.set_page("hello", tuple(RESULTS))
+        self.engine.clear_cache()
+        key = self.engine.get_page_cache_key("hello")
+        self.assertIsNone(self.cache_handler.get_page(key, "Google"))
+        self.assertIsNone(self.engine.get_cached_parse("serp", BING_SERP)[1])
+        # other engines, and the results of earlier versions are kept
+        self.assertIsNotNone(self.cache_handler.get_page(bing.get_page_cache_key("hello"), "Bing"))
+        self.assertIsNotNone(bing.get_cached_parse("serp", BING_SERP)[1])
+        self.assertIsNotNone(self.cache_handler.get_page("hello"))
+        self.engine.clear_cache(all_cache=True)
+        self.assertIsNone(self.cache_handler.get_page(bing.get_page_cache_key("hello"), "Bing"))
+        self.assertIsNone(bing.get_cached_parse("serp", BING_SERP)[1])
+        self.assertIsNone(self.cache_handler.get_page("hello"))
+
+    def test_results_are_copies_of_the_cache(self):
+        self.engine.attach_metrics = False
+        results = AsyncMock(side_effect=lambda *args, **kwargs: [dict(r) for r in RESULTS])
+        with patch.object(self.engine, 'get_source', AsyncMock(return_value=None)), \
+                patch.object(self.engine, 'aget_source_results', results):
+            # searched, then served from the cache
+            for _ in range(2):
+                result = asyncio.run(self.engine.asearch("hello"))
+                self.assertEqual(result, RESULTS[0])
+                result["page"] = "changed by the caller"
+
+    def test_engines_do_not_share_results(self):
+        self.search(self.engine, "hello", topk=1)
+        _, fetches = self.search(BingSearch(cache_handler=self.cache_handler), "hello", topk=1)
+        self.assertEqual(fetches, 1)
+        _, fetches = self.search(self.engine, "hello", topk=1, end_year=2020)
+        self.assertEqual(fetches, 1)
+
+    def test_google_serves_legacy_entries(self):
+        self.cache_handler.set_page("hello", tuple(RESULTS))
+        result, fetches = self.search(self.engine, "hello", topk=2)
+        self.assertEqual((result, fetches), (RESULTS[1], 0))
+        # copied to the current key
+        self.assertEqual(list(self.cache_handler.get_page(self.engine.get_page_cache_key("hello"), "Google")), RESULTS)
+        _, fetches = self.search(BingSearch(cache_handler=self.cache_handler), "hello", topk=1)
+        self.assertEqual(fetches, 1)
+
+
+class DataRegistryTests(unittest.TestCase):
+    """ Domain and user agent lists are read once for every engine """
+
+    def setUp(self):
+        # the base module the engines use
+        self.base = import_module(BingSearch.__mro__[1].__module__)
+        self.addCleanup(self.base.reload_data)
+
+    def test_read_once(self):
+        self.base.reload_data()
+        with patch.object(self.base, 'get_data', wraps=self.base.get_data) as get_data:
+            first, second = BingSearch(), BingSearch()
+        get_data.assert_not_called()
+        self.assertIs(first.domain_list, second.domain_list)
+        self.assertIsInstance(first.agent_list, tuple)
+
+    def test_blocked_domains_removed(self):
+        domains = self.base.get_domains()
+        self.assertTrue(domains)
+        self.assertFalse(set(domains) & set(self.base.utils.blocked_domains))
+        self.assertEqual(len(domains), len(set(domains)))
+
+    def test_reload(self):
+        with patch.object(self.base, 'get_data', return_value=["www.example.com"]):
+            self.base.reload_data()
+        self.assertEqual(self.base.get_domains(), ("www.example.com",))
+        self.assertEqual(self.base.get_user_agents(), ("www.example.com",))
+
+
+class OtherEngineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache_handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+
+    def test_baidu_search(self):
+        engine = BaiduSearch(cache_handler=self.cache_handler)
+        engine.attach_metrics = False
+        with patch.object(engine, 'get_source', AsyncMock(return_value=BAIDU_SERP)) as get_source:
+            result = asyncio.run(engine.asearch("hello"))
+            # served from the page cache
+            self.assertEqual(asyncio.run(engine.asearch("hello")), result)
+        self.assertEqual(result, {"title": "Result 1", "link": "https://example.com/1",
+                                  "description": "Description of result 1"})
+        self.assertEqual(get_source.await_count, 1)
+
+    def test_results_not_serializable(self):
+        soup = BaiduSearch.__new__(BaiduSearch).make_soup(BAIDU_SERP)
+        self.cache_handler.set_page("key", ({"title": "Result 1", "description": soup.find("div")},))
+        self.assertIsNone(self.cache_handler.get_page("key"))
+
+
+class ParseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.engine = BingSearch(cache_handler=utils.CacheHandler(cache_dir=self.tmpdir.name))
+
+    def parse(self, html):
+        return asyncio.run(self.engine.aparse_entries(html))
+
+    def test_cached_serp_is_parsed_once(self):
+        with patch.object(self.engine, 'parse_soup', wraps=self.engine.parse_soup) as parse_soup:
+            entries = self.parse(BING_SERP)
+            self.assertEqual(self.parse(BING_SERP), entries)
+        self.assertEqual(parse_soup.call_count, 1)
+        self.assertEqual([e["link"] for e in entries], ["https://example.com/1", "https://example.com/2"])
+
+    def test_parser_version_invalidates(self):
+        self.parse(BING_SERP)
+        self.engine.parser_version += 1
+        with patch.object(self.engine, 'parse_soup', wraps=self.engine.parse_soup) as parse_soup:
+            self.parse(BING_SERP)
+        self.assertEqual(parse_soup.call_count, 1)
+
+    def test_strainer_keeps_results(self):
+        entries = self.parse(BING_SERP)
+        self.engine.parse_cache = False
+        self.engine.result_strainer = None
+        self.assertEqual(self.parse(BING_SERP), entries)
+
+    def test_strainer_matches_each_class(self):
+        html = """<html><body><div id="nav"><a href="/x">nav</a></div>
+        <div class="Gx5Zad xpd EtOod pkphOe"><a href="/url?q=https://a.com">A</a></div>
+        <div class="other"><div class="Gx5Zad fP1Qef xpd EtOod pkphOe">B</div></div>
+        <div class="Gx5Zad">not a result</div></body></html>"""
+        google = GoogleSearch(cache_handler=self.engine.cache_handler)
+        strained = google.parse_soup(google.make_soup(html))
+        google.result_strainer = None
+        self.assertEqual([str(r) for r in strained], [str(r) for r in google.parse_soup(google.make_soup(html))])
+        self.assertEqual(len(strained), 2)
+
+    def test_no_results(self):
+        self.assertIsNone(self.parse("<html><body></body></html>"))
+        self.assertIsNone(self.parse(None))
+
+
+class ExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache_handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+        self.addCleanup(executor.set_executor, None)
+
+    def test_offloaded_parse_is_the_same(self):
+        engine = BingSearch(cache_handler=self.cache_handler)
+        engine.parse_cache = False
+        expected = engine.extract_entries(BING_SERP)
+        for kind in ("thread", "process"):
+            executor.set_executor(kind, max_workers=2)
+            self.assertEqual(asyncio.run(engine.aparse_entries(BING_SERP)), expected)
+
+    def test_pickled_without_data_lists(self):
+        engine = BingSearch(cache_handler=self.cache_handler)
+        state = pickle.dumps(engine)
+        self.assertLess(len(state), 10000)
+        copied = pickle.loads(state)
+        self.assertIs(copied.domain_list, engine.domain_list)
+        self.assertIs(copied.agent_list, engine.agent_list)
+        # lists set on the engine are kept
+        engine.domain_list = ("www.example.com",)
+        self.assertEqual(pickle.loads(pickle.dumps(engine)).domain_list, ("www.example.com",))
+
+    def test_offloaded_page_matching(self):
+        desc = "The quick brown fox jumps over the lazy dog near the river bank"
+        html = "<html><body><p>Intro. {}. Outro.</p></body></html>".format(desc)
+        engine = GoogleSearch(cache_handler=self.cache_handler)
+        expected = engine.match_page(engine.extract_page_text(html), desc)
+        self.assertIn(desc, expected)
+        executor.set_executor("process", max_workers=1)
+        with patch.object(GoogleSearch, 'get_source', AsyncMock(return_value=html)):
+            self.assertEqual(asyncio.run(engine.aparse_page("https://example.com", desc)), expected)
+            # served from the cached text
+            self.assertEqual(asyncio.run(engine.aparse_page("https://example.com", desc)), expected)
+
+
+class SessionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = BingSearch()
+
+    async def get_session(self):
+        session = await self.engine.get_session()
+        self.assertIs(await self.engine.get_session(), session)
+        return session
+
+    def test_session_closed_with_its_loop(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            first = asyncio.run(self.get_session())
+            second = asyncio.run(self.get_session())
+            gc.collect()
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed and second.closed)
+        self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+        self.assertEqual(len(self.engine._sessions), 1)
+
+    def test_aclose(self):
+        async def run():
+            session = await self.get_session()
+            await self.engine.aclose()
+            self.assertTrue(session.closed)
+            self.assertIsNot(await self.engine.get_session(), session)
+
+        asyncio.run(run())
+
+    def test_close_from_sync_code(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        session = loop.run_until_complete(self.get_session())
+        self.engine.close()
+        self.assertTrue(session.closed)
+        self.assertEqual(self.engine._sessions, {})
+
+
+class ConcurrentPagesTests(unittest.TestCase):
+    """ `acomplete_entries` with `concurrent_pages` """
+
+    def setUp(self):
+        self.engine = BingSearch()
+        self.engine.concurrent_pages = True
+        self.started = []
+        self.cancelled = []
+
+    def complete(self, outcomes):
+        """ acomplete_entry of entries (index, delay): index -> result, None, or an exception """
+        async def acomplete_entry(entry):
+            index, delay = entry
+            self.started.append(index)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled.append(index)
+                raise
+            outcome = outcomes.get(index, index)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return acomplete_entry
+
+    def run_entries(self, delays, num_pages, outcomes=None):
+        entries = list(enumerate(delays))
+        with patch.object(self.engine, 'acomplete_entry', self.complete(outcomes or {})):
+            return asyncio.run(self.engine.acomplete_entries(entries, num_pages))
+
+    def test_fetches_only_needed_pages(self):
+        self.assertEqual(self.run_entries([0.01] * 6, 1), [0])
+        self.assertEqual(self.started, [0])
+
+    def test_skipped_entries_start_the_next_ones(self):
+        results = self.run_entries([0.01] * 6, 2, outcomes={0: None, 2: None})
+        self.assertEqual(results, [1, 3])
+        self.assertEqual(sorted(self.started), [0, 1, 2, 3])
+
+    def test_keeps_page_order(self):
+        self.assertEqual(self.run_entries([0.05, 0.03, 0.01, 0.01], 3), [0, 1, 2])
+        self.assertEqual(self.started, [0, 1, 2])
+
+    def test_page_concurrency(self):
+        self.engine.page_concurrency = 2
+        self.assertEqual(self.run_entries([0.01] * 6, 4), [0, 1, 2, 3])
+
+    def test_leftover_fetches_are_cancelled(self):
+        with self.assertRaises(ValueError):
+            self.run_entries([1, 0.01, 1], 3, outcomes={1: ValueError("page")})
+        self.assertEqual(sorted(self.cancelled), [0, 2])
+
+
+def google_serp(query, end_year):
+    """ Google SERP (second page type) whose links depend on the query and end year """
+    items = "".join(
+        '<div class="ezO2md"><a class="fuLhoc ZWRArf" href="/url?q=https://{0}.example/{1}/{2}">'
+        'Title {2}</a><span class="qXLe6d FrIlee">Description {2} of {0}</span></div>'.format(query, end_year, i)
+        for i in range(1, 4))
+    return "<html><body>{}</body></html>".format(items)
+
+
+class AsyncSearchTests(unittest.TestCase):
+    """ `asearch`, `search_many` and `asearch_many` against `search` """
+
+    JOBS = [("alpha", 1, None), ("beta", 2, 2020), ("alpha", 3, 2021), ("gamma", 1, 2020), ("beta", 1, None)]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.fetches = []
+        # queries whose first SERP is a CAPTCHA page
+        self.flaky = set()
+
+    def engine(self, name):
+        engine = GoogleSearch(cache_handler=utils.CacheHandler(cache_dir="{}/{}".format(self.tmpdir.name, name)))
+        engine.attach_metrics = False
+        self.addCleanup(engine.close)
+        return engine
+
+    async def get_source(self, url, cache=True, **kwargs):
+        params = parse_qs(urlparse(url).query)
+        query = params["q"][0]
+        end_year = params["tbs"][0].rsplit(":", 1)[1] if "tbs" in params else None
+        self.fetches.append(query)
+        # yield to the other searches
+        await asyncio.sleep(0.01)
+        if query in self.flaky:
+            self.flaky.discard(query)
+            return "<html><body>unusual traffic</body></html>"
+        return google_serp(query, end_year)
+
+    async def aparse_page(self, url, desc):
+        await asyncio.sleep(0.01)
+        return "Page of " + url
+
+    def patched(self, engine):
+        return patch.multiple(engine, get_source=self.get_source, aparse_page=self.aparse_page)
+
+    def test_concurrent_searches_match_search(self):
+        sequential = self.engine("sequential")
+        with self.patched(sequential):
+            expected = [sequential.search(query, topk=topk, end_year=end_year)
+                        for query, topk, end_year in self.JOBS]
+        self.assertEqual(expected[2]["link"], "https://alpha.example/2021/3")
+
+        concurrent = self.engine("concurrent")
+        jobs = [(concurrent, query, {"topk": topk, "end_year": end_year}) for query, topk, end_year in self.JOBS]
+        with self.patched(concurrent):
+            self.assertEqual(asyncio.run(asearch_many(jobs)), expected)
+            fetches = len(self.fetches)
+            # served from the page cache
+            self.assertEqual(asyncio.run(asearch_many(jobs)), expected)
+        self.assertEqual(len(self.fetches), fetches)
+
+    def test_retry(self):
+        engine = self.engine("retry")
+        self.flaky = {"beta"}
+        with self.patched(engine):
+            results = engine.search_many(["alpha", "beta"], retry=1, page_cache=False)
+        self.assertEqual([r["link"] for r in results], ["https://alpha.example/None/1", "https://beta.example/None/1"])
+        self.assertEqual(self.fetches.count("beta"), 2)
+
+        self.flaky = {"beta"}
+        with self.patched(engine):
+            result = asyncio.run(engine.asearch("beta", retry=0, page_cache=False, cache=False))
+        # the engine failure, without retries left
+        self.assertEqual(result, {"title": None, "page": None})
+
+    def test_order_and_concurrency(self):
+        engine = self.engine("order")
+        in_flight = []
+        peak = []
+
+        async def asearch(query, **kwargs):
+            in_flight.append(query)
+            peak.append(len(in_flight))
+            # later queries finish first
+            await asyncio.sleep(0.05 / (1 + len(peak)))
+            in_flight.remove(query)
+            return {"page": query}
+
+        queries = ["q{}".format(i) for i in range(12)]
+        with patch.object(engine, 'asearch', asearch):
+            results = engine.search_many(queries, concurrency=3)
+        self.assertEqual([r["page"] for r in results], queries)
+        self.assertEqual(max(peak), 3)
@@ -0,0 +1,173 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from bs4 import BeautifulSoup
+
+from web_tools.core import utils
+
+
+class RetryPolicyTests(unittest.TestCase):
+
+    def test_backoff_grows_and_is_capped(self):
+        policy = utils.RetryPolicy(start_timeout=1, max_timeout=5, factor=2, jitter=0)
+        self.assertEqual([policy.get_timeout(i) for i in range(5)], [1, 2, 4, 5, 5])
+
+    def test_jitter_only_shortens_the_wait(self):
+        policy = utils.RetryPolicy(start_timeout=4, jitter=0.5)
+        with patch('random.random', return_value=1.0):
+            self.assertEqual(policy.get_timeout(0), 2)
+
+    def test_retry_after_is_honored_up_to_max_timeout(self):
+        policy = utils.RetryPolicy(start_timeout=1, max_timeout=10, jitter=0)
+        self.assertEqual(policy.get_timeout(0, retry_after=7), 7)
+        self.assertEqual(policy.get_timeout(0, retry_after=60), 10)
+
+    def test_retryable_statuses(self):
+        policy = utils.RetryPolicy()
+        self.assertTrue(policy.should_retry(utils.HTTPStatusError("u", 429)))
+        self.assertTrue(policy.should_retry(utils.HTTPStatusError("u", 503)))
+        self.assertFalse(policy.should_retry(utils.HTTPStatusError("u", 404)))
+        self.assertTrue(policy.should_retry(ValueError()))
+
+        policy = utils.RetryPolicy(exceptions={TimeoutError}, retry_all_server_errors=False)
+        self.assertFalse(policy.should_retry(utils.HTTPStatusError("u", 503)))
+        self.assertFalse(policy.should_retry(ValueError()))
+        self.assertTrue(policy.should_retry(TimeoutError()))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(utils.parse_retry_after("120"), 120)
+        self.assertIsNone(utils.parse_retry_after(None))
+        self.assertIsNone(utils.parse_retry_after("soon"))
+        self.assertEqual(utils.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+
+class CacheHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(utils.set_cache_handler, None)
+
+    def test_shared_handler_is_built_once(self):
+        utils.set_cache_handler(None)
+        with patch.object(utils, 'CacheHandler', side_effect=lambda: object()) as handler_class:
+            self.assertIs(utils.get_cache_handler(), utils.get_cache_handler())
+        self.assertEqual(handler_class.call_count, 1)
+
+    def test_injected_handler(self):
+        from web_tools.core.engines.bing import Search  # pylint: disable=import-outside-toplevel
+        handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+        self.assertIs(Search(cache_handler=handler).cache_handler, handler)
+        self.assertTrue(handler.page_cache.startswith(self.tmpdir.name))
+
+    def fetch(self, path, **kwargs):
+        async def handler(request):
+            if request.path == "/doc.pdf":
+                return web.Response(body=b"%PDF-1.4", content_type="application/pdf")
+            return web.Response(text="<html><body>" + "x" * 100000 + "</body></html>",
+                                content_type="text/html")
+
+        async def run():
+            app = web.Application()
+            app.router.add_get("/{name}", handler)
+            async with TestServer(app) as server:
+                cache_handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+                return await cache_handler.get_source(
+                    "google", str(server.make_url(path)), {}, cache=False, **kwargs)
+
+        return asyncio.run(run())
+
+    def test_concurrent_fetches_are_coalesced(self):
+        cache_handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+        calls = []
+
+        async def fetch(session, get_vars, *args):
+            calls.append(get_vars['url'])
+            await asyncio.sleep(0.01)
+            return "<html></html>", 200, {}
+
+        async def run(cache):
+            with patch.object(cache_handler, '_fetch', side_effect=fetch):
+                return await asyncio.gather(*[
+                    cache_handler.get_source("google", url, {}, session=object(), cache=cache)
+                    for url in ("http://a", "http://a", "http://a", "http://b")])
+
+        results = asyncio.run(run(cache=False))
+        self.assertEqual(sorted(calls), ["http://a", "http://b"])
+        # joined downloads are not cache hits
+        self.assertEqual([hit for _, hit in results], [False] * 4)
+        self.assertEqual(cache_handler._in_flight, {})
+
+        results = asyncio.run(run(cache=True))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([hit for _, hit in results], [True] * 4)
+
+    def test_download_cancelled_with_its_last_caller(self):
+        cache_handler = utils.CacheHandler(cache_dir=self.tmpdir.name)
+        cancelled = []
+
+        async def fetch(*args):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            with patch.object(cache_handler, '_fetch', side_effect=fetch):
+                first = asyncio.ensure_future(cache_handler.get_source("google", "http://a", {}, session=object()))
+                second = asyncio.ensure_future(cache_handler.get_source("google", "http://a", {}, session=object()))
+                await asyncio.sleep(0.01)
+                first.cancel()
+                await asyncio.sleep(0.01)
+                self.assertEqual(cancelled, [])
+                second.cancel()
+                await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        self.assertEqual(cancelled, [True])
+
+    def test_body_is_capped(self):
+        html, _ = self.fetch("/page", max_bytes=1000)
+        self.assertEqual(len(html), 1000)
+        html, _ = self.fetch("/page")
+        self.assertTrue(html.endswith("</html>"))
+
+    def test_content_type_rejected(self):
+        with self.assertRaises(utils.ContentRejected):
+            self.fetch("/doc.pdf", content_types={"text/html"})
+        self.assertFalse(utils.RetryPolicy().should_retry(utils.ContentRejected("u", "application/pdf")))
+
+
+class TextFromHtmlTests(unittest.TestCase):
+
+    PAGES = [
+        "",
+        "<html><head><title>no body</title></head></html>",
+        "<p>one <b>bold</b> two<!-- comment --> three<sup>[1]</sup></p><p>unclosed <a href=x>link<p>next",
+        "<p>x<script>var a = 1;</script>y<style>p {}</style>z<template>t</template></p>",
+        "<p>a<ruby>kanji<rt>reading</rt><rp>(</rp></ruby> <i>b</i>\n  <i>c</i></p><pre><p>  kept  </p></pre>",
+        "<p>&amp; &nbsp; &copy;</p><table><tr><td><p>cell</p></td></tr></table>",
+        "<?xml version='1.0' encoding='utf-8'?><html><body><p>declaration</p></body></html>",
+        "<html><body><p>before</p></body></html><p>after the end</p>",
+    ]
+
+    def test_same_text_as_soup(self):
+        for html in self.PAGES:
+            soup = BeautifulSoup(html, 'lxml')
+            expected = utils.text_from_soup(soup) if soup.body else None
+            self.assertEqual(utils.text_from_html(html), expected, html)
+
+
+class PostProcessingTests(unittest.TestCase):
+
+    def test_same_output_as_regex_pipeline(self):
+        from web_tools.tests.bench_post_processing import reference_post_processing  # pylint: disable=import-outside-toplevel
+        texts = ["", "   ", "[1]", "[1][2]", " [1] a [2] ", "[[1]]", "x[1]y [] z[a]",
+                 "a\n\nb\tc\r\nd", "a\u3000b\xa0c\x1cd", "\u2003[3] end [4]\u2003", "one  two   three"]
+        for text in texts:
+            self.assertEqual(utils.post_processing(text), reference_post_processing(text), repr(text))